@@ -5,19 +5,37 @@
 
 from __future__ import annotations
 
+from array import array
 import asyncio
-from collections.abc import Coroutine, Iterable
+from bisect import bisect
+from collections import Counter, deque
+from collections.abc import Coroutine, Iterable, Iterator, Mapping
+from contextvars import ContextVar
 from copy import deepcopy
-from datetime import time
+import cProfile
+from dataclasses import dataclass
+from datetime import datetime, time
 from distutils.version import StrictVersion
 from enum import Enum, IntEnum
+from functools import wraps
+import hashlib
 from inspect import stack
+import json
 import logging
+from math import log
+import os
+from pathlib import Path
 from pprint import pformat
+import pstats
 import random
-from typing import Any
+import re
+import sys
+from time import monotonic, strftime
+import types
+from typing import Any, Callable
 
 # pylint: disable=import-error
+import aiohttp
 import hassapi as hass
 
 __version__ = "0.11.4"
@@ -42,11 +60,114 @@ DEFAULT_DAYTIMES: list[dict[str, str | int]] = [
     dict(starttime="22:30", name="night", light=0),
 ]
 DEFAULT_LOGLEVEL = "INFO"
+DEFAULT_HUMIDITY_SAMPLES = 30
+DEFAULT_HUMIDITY_RISE_RATE = 1.0
+DEFAULT_HUMIDITY_MAX_RISE = 3600
+DEFAULT_ADAPTIVE_QUANTILE = 0.9
+DEFAULT_ADAPTIVE_MIN = 60
+DEFAULT_ADAPTIVE_MAX = 900
+DEFAULT_PRELIGHT_DELAY = 20
+DEFAULT_PRELIGHT_PROBABILITY = 0.3
+DEFAULT_PRELIGHT_ROOMS = 1
+DEFAULT_FLAP_WINDOW = 60
+DEFAULT_FLAP_COUNT = 3
+DEFAULT_FLAP_FACTOR = 2.0
+DEFAULT_FLAP_GRACE = 15
+DEFAULT_MANUAL_OVERRIDE = 0
+DEFAULT_JOURNAL_SIZE = 100
+DEFAULT_SERVICE_TIMEOUT = 10
+DEFAULT_SERVICE_RETRIES = 2
+DEFAULT_SENSOR_STUCK = 7200
+DEFAULT_SENSOR_SILENT = 86400
+DEFAULT_SENSOR_CHECK_INTERVAL = 900
+DEFAULT_ENERGY_INTERVAL = 300
+DEFAULT_WATTAGE = 0
+DEFAULT_CIRCADIAN_INTERVAL = 300
+DEFAULT_SHADOW_SIZE = 500
+DEFAULT_PROFILE_SEC = 60
+DEFAULT_EVENT_LOG_SIZE = 4
+DEFAULT_EVENT_LOG_KEEP = 64
+DEFAULT_SHARD_SPREAD = 30
+
+# daytime light setting following the circadian curves
+CIRCADIAN = "circadian"
+CIRCADIAN_TRANSITION_SEC = 5
 
 EVENT_MOTION_XIAOMI = "xiaomi_aqara.motion"
 
 RANDOMIZE_SEC = 5
 SECONDS_PER_MIN: int = 60
+MINUTES_PER_DAY: int = 1440
+
+# humidity rise rates older than this do not count as a climb anymore
+HUMIDITY_RATE_WINDOW_SEC = 300
+
+# local storage of learned data/runtime state
+STORAGE_DIR = "automoli"
+STORAGE_WRITE_INTERVAL = 5
+
+# motion gap histograms (log-spaced bins from 5 sec to 1 hour)
+GAP_BINS = 32
+GAP_MIN_SEC = 5
+GAP_MAX_SEC = 3600
+GAP_BIN_RATIO = (GAP_MAX_SEC / GAP_MIN_SEC) ** (1 / GAP_BINS)
+GAP_MIN_SAMPLES = 20
+GAP_MAX_SAMPLES = 5000
+
+# motion in another room within this window counts as a transition between rooms
+TRANSITION_WINDOW_SEC = 30
+TRANSITION_MIN_SAMPLES = 10
+
+# on/off transitions kept per room and how long a room is considered flapping
+FLAP_HISTORY = 8
+FLAP_PERIOD_SEC = 900
+
+# context ids of own service calls, state changes shortly after own calls without
+# a known context are considered own as well
+CONTEXT_HISTORY = 64
+CONTEXT_SETTLE_SEC = 5
+
+# motion-to-command latencies kept for the journal endpoint
+LATENCY_HISTORY = 100
+
+# typed event log of decisions and commands, in blocks of at most this many rows
+EVENT_LOG_DIR = "events"
+EVENT_LOG_BLOCK_ROWS = 4096
+EVENT_LOG_MAGIC = b"AMEV"
+EVENT_LOG_SEGMENTS = "{name}-[0-9]*-[0-9]*-[0-9]*.events"
+EVENT_LOG_COLUMNS = (
+    ("ts", "d"),
+    ("kind", "B"),
+    ("handler", "H"),
+    ("name", "H"),
+    ("text", "H"),
+    ("value", "d"),
+)
+
+# consistent assignment of rooms to AppDaemon instances (shards), coordinated
+# through files in a shared directory
+SHARD_ENV = "AUTOMOLI_SHARD"
+SHARD_DIR = "shards"
+SHARD_VNODES = 64
+SHARD_REFRESH_SEC = 60
+
+# on-demand profiling of the room handlers, requested via this event
+EVENT_PROFILE = "automoli_profile"
+PROFILE_DIR = "profiles"
+PROFILE_REPORT_LINES = 40
+
+# direct websocket connection to home assistant
+WEBSOCKET_HEARTBEAT_SEC = 30
+WEBSOCKET_RECONNECT_SEC = 5
+WEBSOCKET_CONNECT_TIMEOUT_SEC = 10
+
+# retries of failed service calls and circuit breakers for unresponsive devices
+SERVICE_RETRY_BACKOFF_SEC = 0.5
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN_SEC = 300
+
+# result of a failed or skipped service call, `None` is a valid result
+FAILED = object()
 
 
 class EntityType(Enum):
@@ -126,6 +247,1118 @@ from adutils import Room, hl, natural_time, py38_or_higher, py39_or_higher  # no
 from adutils import py37_or_higher  # noqa
 
 
+class HumidityTrend:
+    """Streaming rise detection for a single humidity sensor.
+
+    Keeps the last `samples` values in a ring buffer together with their running
+    sum, so the rolling baseline and the rise rate are updated in O(1) per sample.
+    A rise is detected when the humidity is `rise` above the baseline, or already
+    half of it while climbing at least `rise_rate` %RH/min. While rising the
+    baseline is frozen, it is released again once the humidity drops below half of
+    the rise, or after `max_rise` seconds without a fast climb: the humidity then
+    settled at a new level, which becomes the baseline.
+    """
+
+    def __init__(
+        self,
+        rise: float,
+        samples: int = DEFAULT_HUMIDITY_SAMPLES,
+        rise_rate: float = DEFAULT_HUMIDITY_RISE_RATE,
+        max_rise: float = DEFAULT_HUMIDITY_MAX_RISE,
+    ) -> None:
+        self.rise = rise
+        self.rise_rate = rise_rate
+        self.max_rise = max_rise
+        self.window: deque[float] = deque(maxlen=max(samples, 1))
+        self.total: float = 0.0
+        self.current: float | None = None
+        self.updated: float | None = None
+        # rise rate in %RH/min, exponentially smoothed
+        self.rate: float = 0.0
+        self.rising: bool = False
+        self.rising_since: float | None = None
+
+    @property
+    def baseline(self) -> float | None:
+        return self.total / len(self.window) if self.window else None
+
+    @property
+    def delta(self) -> float:
+        if (baseline := self.baseline) is None or self.current is None:
+            return 0.0
+        return self.current - baseline
+
+    def climbing(self, timestamp: float) -> bool:
+        """if the humidity recently rose at least `rise_rate` %RH/min"""
+        return bool(
+            self.updated is not None
+            and timestamp - self.updated <= HUMIDITY_RATE_WINDOW_SEC
+            and self.rate >= self.rise_rate
+        )
+
+    def add(self, value: float, timestamp: float) -> bool:
+        """add a sample and return if the humidity is rising over the baseline"""
+
+        if self.current is not None and self.updated is not None:
+            if (elapsed := timestamp - self.updated) > 0:
+                rate = (value - self.current) / elapsed * SECONDS_PER_MIN
+                self.rate = (self.rate + rate) / 2
+
+        self.current = value
+        self.updated = timestamp
+
+        if self.window:
+            if self.rising:
+                rising = self.delta >= self.rise / 2
+            else:
+                rising = self.delta >= self.rise or (
+                    self.delta >= self.rise / 2 and self.climbing(timestamp)
+                )
+            if rising and not self.rising:
+                self.rising_since = timestamp
+            self.rising = rising
+
+        # keep the baseline free of the rise itself
+        if not self.check(timestamp):
+            if len(self.window) == self.window.maxlen:
+                self.total -= self.window[0]
+            self.window.append(value)
+            self.total += value
+
+        return self.rising
+
+    def check(self, timestamp: float) -> bool:
+        """return if still rising, a rise without fast climb times out"""
+
+        if (
+            self.rising
+            and self.rising_since is not None
+            and timestamp - self.rising_since > self.max_rise
+            and not self.climbing(timestamp)
+            and self.current is not None
+        ):
+            # settled at a new level → new baseline
+            self.rising, self.rising_since = False, None
+            self.window.clear()
+            self.window.append(self.current)
+            self.total = self.current
+
+        return self.rising
+
+
+class StateView(Mapping[str, Any]):
+    """Read-only, zero-copy view of AppDaemon's state, nested dicts are views too."""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        self._data = data
+
+    def __getitem__(self, key: str) -> Any:
+        return read_only(self._data[key])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self._data!r})"
+
+    def copy(self) -> dict[str, Any]:
+        """shallow copy of the underlying dict, for writing it back"""
+        return dict(self._data)
+
+
+def read_only(value: Any) -> Any:
+    """wrap dicts in a read-only view instead of copying them"""
+    return StateView(value) if isinstance(value, dict) else value
+
+
+@dataclass
+class EntityMeta:
+    """Rarely changing attributes of a light/switch."""
+
+    entity_id: str
+    friendly_name: str
+    is_hue_group: bool = False
+    supported_color_modes: frozenset[str] = frozenset()
+    dimmable: bool = False
+
+    # attributes the metadata is built from
+    ATTRIBUTES = ("friendly_name", "is_hue_group", "supported_color_modes")
+
+    @classmethod
+    def from_state(cls, entity_id: str, state: Mapping[str, Any] | None) -> EntityMeta:
+        attributes = (state or {}).get("attributes") or {}
+        color_modes = frozenset(attributes.get("supported_color_modes") or [])
+
+        return cls(
+            entity_id=entity_id,
+            friendly_name=str(attributes.get("friendly_name", entity_id)),
+            is_hue_group=bool(attributes.get("is_hue_group", False)),
+            supported_color_modes=color_modes,
+            dimmable=entity_id.startswith("light.")
+            and (not color_modes or bool(color_modes - {"onoff"})),
+        )
+
+
+def context_ids(result: Any) -> list[str]:
+    """context ids in a service call result (websocket result or changed states)"""
+
+    if isinstance(result, dict):
+        if isinstance(context := result.get("context"), dict) and context.get("id"):
+            return [str(context["id"])]
+        return context_ids(result.get("result"))
+
+    if isinstance(result, list):
+        return [context_id for item in result for context_id in context_ids(item)]
+
+    return []
+
+
+class ContextIds:
+    """Bounded set of the context ids of the last own service calls."""
+
+    def __init__(self, size: int = CONTEXT_HISTORY) -> None:
+        self.order: deque[str] = deque()
+        self.ids: set[str] = set()
+        self.size = size
+
+    def add(self, context_id: str) -> None:
+        if context_id in self.ids:
+            return
+        if len(self.order) >= self.size:
+            self.ids.discard(self.order.popleft())
+        self.order.append(context_id)
+        self.ids.add(context_id)
+
+    def __contains__(self, context_id: object) -> bool:
+        return context_id in self.ids
+
+
+class CircuitBreaker:
+    """Skips calls to an entity for `cooldown` seconds after repeated failures.
+
+    After the cooldown a single call is let through again (half-open), a success
+    closes the breaker, another failure opens it for the next cooldown.
+    """
+
+    def __init__(
+        self, threshold: int = BREAKER_THRESHOLD, cooldown: int = BREAKER_COOLDOWN_SEC
+    ) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures: int = 0
+        self.opened: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened is not None
+
+    def allow(self, timestamp: float) -> bool:
+        return self.opened is None or timestamp - self.opened >= self.cooldown
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened = None
+
+    def failure(self, timestamp: float) -> bool:
+        """record a failure and return if the breaker has been opened by it"""
+
+        self.failures += 1
+        if self.failures < self.threshold:
+            return False
+
+        was_open = self.is_open
+        self.opened = timestamp
+        return not was_open
+
+
+class SensorHealth:
+    """Last change and event rate of a motion sensor, updated per event."""
+
+    def __init__(self, state: str | None, timestamp: float) -> None:
+        self.state = state
+        self.changed = timestamp
+        # events per hour, exponentially smoothed
+        self.rate: float = 0.0
+        self.status: str = "ok"
+
+    def seen(self, state: str | None, timestamp: float) -> None:
+        if (interval := timestamp - self.changed) > 0:
+            self.rate = 0.8 * self.rate + 0.2 * 3600 / interval
+        self.state = state
+        self.changed = timestamp
+
+    def check(
+        self, timestamp: float, stuck: int, silent: int, on_state: str | None
+    ) -> str:
+        if on_state and self.state == on_state and timestamp - self.changed >= stuck:
+            return "stuck"
+        if timestamp - self.changed >= silent:
+            return "silent"
+        return "ok"
+
+
+class GapHistogram:
+    """Distribution of the gaps between motion events in a room.
+
+    Counts are kept in a fixed number of logarithmically spaced bins, updates are
+    O(1) and quantiles only walk the (constant) number of bins. Old samples fade
+    out by halving all counts once `GAP_MAX_SAMPLES` is reached.
+    """
+
+    def __init__(self, counts: list[int] | None = None) -> None:
+        self.counts: list[int] = (
+            list(counts) if counts and len(counts) == GAP_BINS else [0] * GAP_BINS
+        )
+        self.total: int = sum(self.counts)
+
+    def add(self, gap: float) -> None:
+        idx = int(log(max(gap, GAP_MIN_SEC) / GAP_MIN_SEC) / log(GAP_BIN_RATIO))
+        self.counts[min(idx, GAP_BINS - 1)] += 1
+        self.total += 1
+
+        if self.total >= GAP_MAX_SAMPLES:
+            self.counts = [count // 2 for count in self.counts]
+            self.total = sum(self.counts)
+
+    def quantile(self, quantile: float) -> float:
+        """upper bin edge below which `quantile` of the gaps fall"""
+
+        cumulated = 0
+        for idx, count in enumerate(self.counts):
+            cumulated += count
+            if cumulated >= quantile * self.total:
+                return float(GAP_MIN_SEC * GAP_BIN_RATIO ** (idx + 1))
+
+        return float(GAP_MAX_SEC)
+
+
+class RoomTransitions:
+    """Counts how often motion in one room is followed by motion in another room."""
+
+    def __init__(self) -> None:
+        self.counts: dict[str, dict[str, int]] = {}
+        self.last: tuple[str, float] | None = None
+
+    def motion(self, room: str, timestamp: float) -> None:
+        if (
+            self.last
+            and self.last[0] != room
+            and timestamp - self.last[1] <= TRANSITION_WINDOW_SEC
+        ):
+            targets = self.counts.setdefault(self.last[0], {})
+            targets[room] = targets.get(room, 0) + 1
+
+        self.last = (room, timestamp)
+
+    def likely(
+        self, room: str, candidates: list[str], probability: float, limit: int
+    ) -> list[str] | None:
+        """most likely next rooms, `None` if not enough transitions were seen yet"""
+
+        targets = self.counts.get(room, {})
+        if (total := sum(targets.values())) < TRANSITION_MIN_SAMPLES:
+            return None
+
+        ranked = sorted(targets.items(), key=lambda target: target[1], reverse=True)
+        return [
+            target
+            for target, count in ranked
+            if (not candidates or target in candidates) and count / total >= probability
+        ][:limit]
+
+
+class FlapDetector:
+    """Detects rooms cycling between on and off within seconds.
+
+    The recent on/off transitions are kept in a small ring buffer, switching on
+    within `window` seconds after switching off counts as a flap. A room with
+    `count` flaps within `FLAP_PERIOD_SEC` is flapping.
+    """
+
+    def __init__(self, window: int, count: int, factor: float, grace: int) -> None:
+        self.window = window
+        self.factor = factor
+        self.grace = grace
+        self.transitions: deque[tuple[str, float]] = deque(maxlen=FLAP_HISTORY)
+        self.flaps: deque[float] = deque(maxlen=max(count, 1))
+        # lights switched off by the last transition
+        self.lights_off: set[str] = set()
+        self.stats: dict[str, int] = {"flaps": 0, "restored": 0, "extended": 0}
+
+    def switched(self, state: str, timestamp: float) -> bool:
+        """record a transition and return if it was a flap"""
+
+        flap = bool(
+            state == "on"
+            and self.transitions
+            and self.transitions[-1][0] == "off"
+            and timestamp - self.transitions[-1][1] <= self.window
+        )
+
+        if flap:
+            self.flaps.append(timestamp)
+            self.stats["flaps"] += 1
+
+        self.transitions.append((state, timestamp))
+        return flap
+
+    def flapping(self, timestamp: float) -> bool:
+        return bool(
+            len(self.flaps) == self.flaps.maxlen
+            and timestamp - self.flaps[0] <= FLAP_PERIOD_SEC
+        )
+
+    def in_grace(self, timestamp: float) -> bool:
+        return bool(
+            self.lights_off
+            and self.transitions
+            and self.transitions[-1][0] == "off"
+            and timestamp - self.transitions[-1][1] <= self.grace
+        )
+
+
+# decision record of the handler currently running
+DECISION: ContextVar[dict[str, Any] | None] = ContextVar("decision", default=None)
+
+
+def journaled(handler: Callable[..., Any]) -> Callable[..., Any]:
+    """record the decision of a handler in the rooms journal.
+
+    Only the outermost handler creates a record, nested handlers (e.g. `lights_on`
+    called by `motion_event`) add their gates and actions to it.
+    """
+
+    @wraps(handler)
+    async def wrapper(self: AutoMoLi, *args: Any, **kwargs: Any) -> Any:
+        if DECISION.get() is not None or not (self.journal.maxlen or self.event_log):
+            return await handler(self, *args, **kwargs)
+
+        record: dict[str, Any] = {
+            "ts": datetime.now().timestamp(),
+            "handler": handler.__name__,
+            "input": next(
+                (
+                    arg.get("entity_id")
+                    for arg in args
+                    if isinstance(arg, dict) and "entity_id" in arg
+                ),
+                args[0] if args and isinstance(args[0], str) else None,
+            ),
+            "gates": {},
+            "actions": [],
+        }
+        token = DECISION.set(record)
+        blocks = sys.getallocatedblocks() if self.allocations else None
+        started = monotonic()
+
+        try:
+            return await handler(self, *args, **kwargs)
+        finally:
+            record["ms"] = round((monotonic() - started) * 1000, 3)
+            if blocks is not None:
+                record["blocks"] = sys.getallocatedblocks() - blocks
+            DECISION.reset(token)
+            self.journal.append(record)
+            if self.event_log:
+                self.event_log.decision(record)
+
+    return wrapper
+
+
+# set while any profiler steps a handler, nested handlers are part of its profile
+PROFILING: ContextVar[bool] = ContextVar("profiling", default=False)
+
+
+class Profiler:
+    """cProfile of the handlers of a room for a fixed window.
+
+    The profile is only enabled while a profiled handler runs, between its awaits.
+    Other apps and rooms sharing the event loop stay out of it.
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+        self.started = datetime.now()
+        self.profile = cProfile.Profile()
+        self.calls: Counter[str] = Counter()
+
+    async def run(self, name: str, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        self.calls[name] += 1
+        token = PROFILING.set(True)
+        try:
+            return await self._stepped(coroutine)
+        finally:
+            PROFILING.reset(token)
+
+    @types.coroutine
+    def _stepped(self, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        value: Any = None
+        error: BaseException | None = None
+        while True:
+            self.profile.enable()
+            try:
+                if error is None:
+                    future = coroutine.send(value)
+                else:
+                    future = coroutine.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profile.disable()
+
+            try:
+                value, error = (yield future), None
+            except BaseException as exc:  # pylint: disable=broad-except
+                value, error = None, exc
+
+    def write(self, directory: Path, name: str) -> list[Path]:
+        """dump the profile as pstats and a report sorted by cumulative time"""
+
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = directory / f"{name}-{self.started.strftime('%Y%m%d-%H%M%S')}"
+        dump, report = stem.with_suffix(".pstats"), stem.with_suffix(".txt")
+
+        self.profile.dump_stats(dump)
+        with report.open("w") as stream:
+            stream.write(
+                f"{name}: {self.seconds}s from {self.started.isoformat()} until "
+                f"{strftime('%H:%M:%S')}, calls {dict(self.calls)}\n"
+            )
+            if self.calls:
+                pstats.Stats(self.profile, stream=stream).sort_stats(
+                    "cumulative"
+                ).print_stats(PROFILE_REPORT_LINES)
+
+        return [dump, report]
+
+
+def profiled(handler: Callable[..., Any]) -> Callable[..., Any]:
+    """profile a handler while the rooms profiler is running"""
+
+    @wraps(handler)
+    async def wrapper(self: AutoMoLi, *args: Any, **kwargs: Any) -> Any:
+        if self.profiler is None or PROFILING.get():
+            return await handler(self, *args, **kwargs)
+        return await self.profiler.run(handler.__name__, handler(self, *args, **kwargs))
+
+    return wrapper
+
+
+async def detached(coroutine: Coroutine[Any, Any, Any]) -> Any:
+    """run a coroutine as its own decision & profile.
+
+    Tasks start with a copy of the current context, the copy is reset here.
+    """
+    DECISION.set(None)
+    PROFILING.set(False)
+    return await coroutine
+
+
+# all rooms managed by AutoMoLi in this AppDaemon instance
+ROOMS: dict[str, AutoMoLi] = {}
+TRANSITIONS = RoomTransitions()
+
+
+class HAWebsocket:
+    """Persistent websocket connection to Home Assistant, shared by rooms.
+
+    Commands are pipelined: every message gets an id and its result is matched by
+    that id, so service calls of all rooms can be in flight at the same time.
+    Subscriptions are renewed after a reconnect.
+    """
+
+    def __init__(self, url: str, token: str) -> None:
+        self.url = url
+        self.token = token
+        self.users = 0
+        self._session: aiohttp.ClientSession | None = None
+        self._ws: aiohttp.ClientWebSocketResponse | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._connecting = asyncio.Lock()
+        self._last_id = 0
+        self._pending: dict[int, asyncio.Future[dict[str, Any]]] = {}
+        self._subscriptions: dict[Callable[..., None], dict[str, Any]] = {}
+        self._handlers: dict[int, Callable[..., None]] = {}
+
+    async def connect(self) -> aiohttp.ClientWebSocketResponse:
+        async with self._connecting:
+            if self._ws is not None and not self._ws.closed:
+                return self._ws
+
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession()
+
+            ws = await self._session.ws_connect(
+                self.url, heartbeat=WEBSOCKET_HEARTBEAT_SEC
+            )
+            try:
+                await ws.receive_json()  # auth_required
+                await ws.send_json({"type": "auth", "access_token": self.token})
+                if (auth := await ws.receive_json()).get("type") != "auth_ok":
+                    raise ConnectionError(
+                        f"authentication failed: {auth.get('message', auth)}"
+                    )
+            except BaseException:
+                await ws.close()
+                raise
+
+            self._ws = ws
+            self._start(self._read(ws))
+
+            for handler, message in self._subscriptions.items():
+                msg_id, _ = await self._send(ws, message)
+                self._handlers[msg_id] = handler
+
+            return ws
+
+    async def command(self, message: dict[str, Any]) -> dict[str, Any]:
+        """send a command and wait for its result"""
+        msg_id, future = await self._send(await self.connect(), message)
+        try:
+            return await future
+        finally:
+            self._pending.pop(msg_id, None)
+
+    async def call_service(self, service: str, **data: Any) -> dict[str, Any]:
+        """call a service given as `domain/service` like appdaemon's `call_service`"""
+        domain, name = service.split("/", 1)
+        message = {"type": "call_service", "domain": domain, "service": name}
+        if (entity_id := data.pop("entity_id", None)) is not None:
+            message["target"] = {"entity_id": entity_id}
+        return await self.command({**message, "service_data": data})
+
+    async def subscribe_entities(
+        self, entity_ids: Iterable[str], handler: Callable[[dict[str, Any]], None]
+    ) -> dict[str, Any]:
+        """receive the (compressed) states of some entities and all their changes"""
+        ws = await self.connect()
+        message = {"type": "subscribe_entities", "entity_ids": sorted(entity_ids)}
+        self._subscriptions[handler] = message
+        msg_id, future = await self._send(ws, message)
+        self._handlers[msg_id] = handler
+        return await future
+
+    async def unsubscribe(self, handler: Callable[..., None]) -> None:
+        self._subscriptions.pop(handler, None)
+        for msg_id in [i for i, h in self._handlers.items() if h == handler]:
+            del self._handlers[msg_id]
+            if self._ws is not None and not self._ws.closed:
+                await self._send(
+                    self._ws, {"type": "unsubscribe_events", "subscription": msg_id}
+                )
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._ws is not None:
+            await self._ws.close()
+        if self._session is not None:
+            await self._session.close()
+
+    async def _send(
+        self, ws: aiohttp.ClientWebSocketResponse, message: dict[str, Any]
+    ) -> tuple[int, asyncio.Future[dict[str, Any]]]:
+        self._last_id += 1
+        msg_id = self._last_id
+        future = self._pending[msg_id] = asyncio.get_running_loop().create_future()
+        # results of renewed subscriptions are not awaited
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        await ws.send_json({**message, "id": msg_id})
+        return msg_id, future
+
+    async def _read(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                data = json.loads(msg.data)
+                for message in data if isinstance(data, list) else [data]:
+                    if message.get("type") == "result":
+                        future = self._pending.pop(message.get("id"), None)
+                        if future is not None and not future.done():
+                            future.set_result(message)
+                    elif handler := self._handlers.get(message.get("id")):
+                        handler(message.get("event") or {})
+        finally:
+            # calls in flight fail, subscriptions are renewed on reconnect
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("websocket closed"))
+            self._pending.clear()
+            self._handlers.clear()
+            if self.users and self._subscriptions:
+                self._start(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while self.users:
+            await asyncio.sleep(WEBSOCKET_RECONNECT_SEC)
+            try:
+                await self.connect()
+                return
+            except (aiohttp.ClientError, ConnectionError, OSError):
+                continue
+
+    def _start(self, coroutine: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+# websocket connections by url, shared by the rooms using them
+WEBSOCKETS: dict[str, HAWebsocket] = {}
+
+
+class StateFile:
+    """JSON file in the local AutoMoLi storage directory.
+
+    Writes are coalesced to at most one every `interval` seconds. `collect` is
+    called on the event loop and has to return a fresh, JSON serializable dict,
+    serialization and file I/O run in the default executor.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        collect: Callable[[], dict[str, Any]],
+        interval: float = STORAGE_WRITE_INTERVAL,
+    ) -> None:
+        self.path = path
+        self.collect = collect
+        self.interval = interval
+        self.pending: asyncio.Future[None] | None = None
+        self.lock = asyncio.Lock()
+
+    async def load(self) -> dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._read)
+
+    def schedule(self) -> None:
+        if self.pending is None or self.pending.done():
+            self.pending = asyncio.ensure_future(self._write_later())
+
+    async def flush(self) -> None:
+        if self.pending and not self.pending.done():
+            self.pending.cancel()
+        await self.write()
+
+    async def write(self) -> None:
+        async with self.lock:
+            data = self.collect()
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write, data)
+
+    async def _write_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        await asyncio.shield(self.write())
+
+    def _read(self) -> dict[str, Any]:
+        try:
+            with self.path.open(encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _write(self, data: dict[str, Any]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f"{self.path.suffix}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as fp:
+            json.dump(data, fp, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+
+def ring_hash(key: str) -> int:
+    """stable 64 bit hash, the same in all processes"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring of shards, each placed at `vnodes` points.
+
+    A key belongs to the next shard point clockwise, adding or removing a shard only
+    moves the keys next to its own points.
+    """
+
+    def __init__(self, shards: Iterable[str], vnodes: int = SHARD_VNODES) -> None:
+        self.points = sorted(
+            (ring_hash(f"{shard}#{vnode}"), shard)
+            for shard in set(shards)
+            for vnode in range(vnodes)
+        )
+        self.hashes = [point for point, _ in self.points]
+
+    def owner(self, key: str) -> str:
+        return self.points[bisect(self.hashes, ring_hash(key)) % len(self.points)][1]
+
+
+class ShardChannel:
+    """Coordination of AutoMoLi instances through files in a shared directory.
+
+    Every shard only writes its own file, listing its rooms and their entities.
+    Reading all files gives the house-wide view, e.g. for a common order of the
+    daytime switches or to find entities discovered by rooms of multiple shards.
+    """
+
+    def __init__(self, directory: Path, shard: str) -> None:
+        self.directory = directory
+        self.shard = shard
+        self.users = 0
+        self.rooms: dict[str, dict[str, Any]] = {}
+        self.state_file = StateFile(directory / f"{shard}.json", self.collect)
+        self._shards: dict[str, dict[str, dict[str, Any]]] = {}
+        self._read_at: float | None = None
+
+    def collect(self) -> dict[str, Any]:
+        return {
+            "shard": self.shard,
+            "ts": datetime.now().timestamp(),
+            "rooms": deepcopy(self.rooms),
+        }
+
+    def publish(self, room: str, entities: Iterable[str]) -> None:
+        self.rooms[room] = {"entities": sorted(entities)}
+        self.state_file.schedule()
+
+    def withdraw(self, room: str) -> None:
+        if self.rooms.pop(room, None) is not None:
+            self.state_file.schedule()
+
+    async def view(
+        self, max_age: float = SHARD_REFRESH_SEC
+    ) -> dict[str, dict[str, Any]]:
+        """the rooms of all shards with their shard & entities"""
+
+        return {
+            room: {**data, "shard": shard}
+            for shard, rooms in {
+                **await self.others(max_age),
+                self.shard: self.rooms,
+            }.items()
+            for room, data in rooms.items()
+        }
+
+    async def others(
+        self, max_age: float = SHARD_REFRESH_SEC
+    ) -> dict[str, dict[str, dict[str, Any]]]:
+        """the rooms published by the other shards, by shard"""
+
+        if self._read_at is None or monotonic() - self._read_at > max_age:
+            loop = asyncio.get_running_loop()
+            self._shards = await loop.run_in_executor(None, self._read)
+            self._read_at = monotonic()
+
+        return self._shards
+
+    async def owns(self, room: str) -> bool:
+        """if this shard keeps a room which other shards run as well.
+
+        Shards with differing lists of shards may all consider themselves the owner
+        of a room, the ring of the claiming shards decides the same on all of them.
+        """
+
+        claiming = [
+            shard
+            for shard, rooms in (await self.others(max_age=0)).items()
+            if room in rooms
+        ]
+        return (
+            not claiming or HashRing([self.shard, *claiming]).owner(room) == self.shard
+        )
+
+    async def claims(self, room: str, entities: Iterable[str]) -> dict[str, str]:
+        """entities also used by rooms of other shards, with these rooms"""
+
+        wanted = set(entities)
+        return {
+            entity: other
+            for other, data in (await self.view(max_age=0)).items()
+            if other != room and data["shard"] != self.shard
+            for entity in wanted.intersection(data.get("entities", []))
+        }
+
+    async def offset(self, room: str, spread: float) -> float:
+        """the slot of a room in the house-wide order of simultaneous switches"""
+
+        rooms = sorted(await self.view())
+        return spread * rooms.index(room) / len(rooms) if room in rooms else 0.0
+
+    def _read(self) -> dict[str, dict[str, dict[str, Any]]]:
+        shards: dict[str, dict[str, dict[str, Any]]] = {}
+        for path in sorted(self.directory.glob("*.json")):
+            if path.stem == self.shard:
+                continue
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            shards[str(data.get("shard", path.stem))] = data.get("rooms", {})
+        return shards
+
+
+# shard channels by directory, shared by the rooms of this instance
+SHARDS: dict[Path, ShardChannel] = {}
+
+
+class EventKind(IntEnum):
+    DECISION = 0
+    GATE = 1
+    ACTION = 2
+    COMMAND = 3
+    FAILED = 4
+
+
+class EventLog:
+    """Typed records of decisions and commands in rotating binary segments.
+
+    Rows are buffered in columns and appended as a block to the current segment at
+    most every `interval` seconds, file I/O runs in the default executor. A block
+    is a JSON header (row count, column types, string table) followed by the raw
+    columns, strings are stored as codes into the blocks string table. Segments
+    rotate at `max_bytes`, only the newest `keep` segments are kept.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        name: str,
+        max_bytes: int,
+        keep: int,
+        interval: float = STORAGE_WRITE_INTERVAL,
+    ) -> None:
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.interval = interval
+        self.segment: Path | None = None
+        self.pending: asyncio.Future[None] | None = None
+        self.lock = asyncio.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.columns = {column: array(code) for column, code in EVENT_LOG_COLUMNS}
+        self.strings: dict[str, int] = {}
+
+    def code(self, string: str) -> int:
+        return self.strings.setdefault(string, len(self.strings))
+
+    def append(
+        self,
+        ts: float,
+        kind: EventKind,
+        handler: str = "",
+        name: str = "",
+        text: str = "",
+        value: float = float("nan"),
+    ) -> None:
+        columns = self.columns
+        columns["ts"].append(ts)
+        columns["kind"].append(kind)
+        columns["handler"].append(self.code(handler))
+        columns["name"].append(self.code(name))
+        columns["text"].append(self.code(text))
+        columns["value"].append(value)
+
+        if len(columns["ts"]) >= EVENT_LOG_BLOCK_ROWS:
+            asyncio.ensure_future(self.write())
+        else:
+            self.schedule()
+
+    def decision(self, record: dict[str, Any]) -> None:
+        """the rows of a journaled decision, its gates and actions"""
+
+        ts, handler = record["ts"], record["handler"]
+        source = "" if record["input"] is None else str(record["input"])
+        self.append(ts, EventKind.DECISION, handler, source, "", record["ms"])
+        for gate, value in record["gates"].items():
+            number = float(value) if isinstance(value, (bool, int, float)) else None
+            self.append(
+                ts,
+                EventKind.GATE,
+                handler,
+                gate,
+                "" if number is not None else str(value),
+                float("nan") if number is None else number,
+            )
+        for action in record["actions"]:
+            self.append(ts, EventKind.ACTION, handler, source, action)
+
+    def schedule(self) -> None:
+        if self.pending is None or self.pending.done():
+            self.pending = asyncio.ensure_future(self._write_later())
+
+    async def flush(self) -> None:
+        if self.pending and not self.pending.done():
+            self.pending.cancel()
+        await self.write()
+
+    async def write(self) -> None:
+        async with self.lock:
+            if not self.columns["ts"]:
+                return
+            columns, strings = self.columns, list(self.strings)
+            self._reset()
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write, columns, strings)
+
+    async def _write_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        await asyncio.shield(self.write())
+
+    def _write(self, columns: dict[str, array[Any]], strings: list[str]) -> None:
+        header = json.dumps(
+            {
+                "rows": len(columns["ts"]),
+                "byteorder": sys.byteorder,
+                "columns": [[column, code] for column, code in EVENT_LOG_COLUMNS],
+                "strings": strings,
+            },
+            separators=(",", ":"),
+        ).encode()
+
+        if self.segment is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.segment = self.directory / (
+                f"{self.name}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.events"
+            )
+
+        with self.segment.open("ab") as fp:
+            fp.write(EVENT_LOG_MAGIC + len(header).to_bytes(4, "little") + header)
+            for column in columns.values():
+                column.tofile(fp)
+            size = fp.tell()
+
+        # rotate and remove the oldest segments
+        if size >= self.max_bytes:
+            self.segment = None
+            for old in sorted(
+                self.directory.glob(EVENT_LOG_SEGMENTS.format(name=self.name))
+            )[: -self.keep]:
+                old.unlink(missing_ok=True)
+
+
+def read_events(path: Path) -> Iterator[tuple[dict[str, array[Any]], list[str]]]:
+    """the blocks of an event log segment as columns and string table"""
+
+    with path.open("rb") as fp:
+        while prefix := fp.read(8):
+            if len(prefix) < 8 or prefix[:4] != EVENT_LOG_MAGIC:
+                return
+            header = json.loads(fp.read(int.from_bytes(prefix[4:], "little")))
+            columns: dict[str, array[Any]] = {}
+            for column, code in header["columns"]:
+                columns[column] = values = array(code)
+                try:
+                    values.fromfile(fp, header["rows"])
+                except EOFError:
+                    return  # block cut short by a crash
+                if header["byteorder"] != sys.byteorder:
+                    values.byteswap()
+            yield columns, header["strings"]
+
+
+def load_events(directory: Path | str, name: str = "*") -> Any:
+    """all event log segments of a room (or all rooms) as a pandas DataFrame"""
+
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+
+    frames = []
+    for segment in sorted(Path(directory).glob(EVENT_LOG_SEGMENTS.format(name=name))):
+        for columns, strings in read_events(segment):
+            table = np.array(strings, dtype=object)
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "room": segment.name.rsplit("-", 3)[0],
+                        "ts": pd.to_datetime(np.asarray(columns["ts"]), unit="s"),
+                        "kind": np.asarray(columns["kind"]),
+                        **{
+                            column: table[np.asarray(columns[column])]
+                            for column in ("handler", "name", "text")
+                        },
+                        "value": np.asarray(columns["value"]),
+                    }
+                )
+            )
+
+    if not frames:
+        return pd.DataFrame()
+
+    events = pd.concat(frames, ignore_index=True)
+    events["kind"] = pd.Categorical.from_codes(
+        events["kind"], [kind.name.lower() for kind in EventKind]
+    )
+    for column in ("room", "handler", "name", "text"):
+        events[column] = events[column].astype("category")
+    return events
+
+
+def compile_curve(points: dict[int, float]) -> array[int]:
+    """minute-resolution lookup table for a curve through (minute of day → value)
+    points, linearly interpolated in between and wrapping around midnight"""
+
+    table = array("H", [0]) * MINUTES_PER_DAY
+    ordered = sorted(points.items())
+
+    for idx, (start, value) in enumerate(ordered):
+        end, next_value = ordered[(idx + 1) % len(ordered)]
+        span = (end - start) % MINUTES_PER_DAY or MINUTES_PER_DAY
+        for step in range(span):
+            table[(start + step) % MINUTES_PER_DAY] = round(
+                value + (next_value - value) * step / span
+            )
+
+    return table
+
+
+class Notifications:
+    """In-loop notification stage of a room.
+
+    Notifications are delivered after the current handler by a single task, in
+    the order they were issued. A notification already waiting is not added again.
+    """
+
+    def __init__(self, deliver: Callable[..., None]) -> None:
+        self.deliver = deliver
+        self._pending: dict[str, tuple[tuple[Any, ...], dict[str, Any]]] = {}
+        self._task: asyncio.Future[None] | None = None
+
+    def notify(self, key: str, *args: Any, **kwargs: Any) -> None:
+        if key in self._pending:
+            return
+        self._pending[key] = (args, kwargs)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._drain())
+
+    async def _drain(self) -> None:
+        await asyncio.sleep(0)
+        while self._pending:
+            key = next(iter(self._pending))
+            args, kwargs = self._pending.pop(key)
+            try:
+                self.deliver(*args, **kwargs)
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger(__name__).exception("notification %s failed", key)
+
+
+@dataclass
+class Zone:
+    """Lights of a room switched by their own motion sensors & timer."""
+
+    name: str
+    lights: set[str]
+    motion: set[str]
+    delay: int | None = None
+    handle: str | None = None
+
+
 class DimMethod(IntEnum):
     """IntEnum representing the transition-to-off method used."""
 
@@ -214,8 +1447,16 @@ class AutoMoLi(hass.Hass):  # type: ignore
 
         self.log_to_ha = self.args.get("log_to_ha", False)
 
-        # notification thread (prevents doubled messages)
-        self.notify_thread = random.randint(0, 9)  # nosec
+        # shadow mode: decide as usual, but record commands instead of sending them
+        self.shadow: deque[dict[str, Any]] | None = None
+        if shadow := self.args.pop("shadow", False):
+            self.shadow = deque(
+                maxlen=DEFAULT_SHADOW_SIZE if isinstance(shadow, bool) else int(shadow)
+            )
+            self.lg(f"{hl('shadow mode')} → commands are recorded, not sent")
+
+        # in-loop notifications (prevents doubled messages)
+        self.notifications = Notifications(self.lg)
 
         self.lg(
             f"setting log level to {logging.getLevelName(self.loglevel)}",
@@ -254,6 +1495,7 @@ class AutoMoLi(hass.Hass):  # type: ignore
         self.states = {
             "motion_on": self.args.pop("motion_state_on", None),
             "motion_off": self.args.pop("motion_state_off", None),
+            "door_window_open": self.args.pop("door_window_state_open", "on"),
         }
 
         # threshold values
@@ -262,6 +1504,23 @@ class AutoMoLi(hass.Hass):  # type: ignore
             EntityType.ILLUMINANCE.idx: self.args.pop("illuminance_threshold", None),
         }
 
+        # humidity rise over a rolling baseline instead of an absolute threshold
+        self.humidity_trend: dict[str, float | int] = {}
+        self.humidity_trends: dict[str, HumidityTrend] = {}
+        if humidity_rise := self.args.pop("humidity_rise", None):
+            self.humidity_trend = {
+                "rise": float(humidity_rise),
+                "samples": int(
+                    self.args.pop("humidity_samples", DEFAULT_HUMIDITY_SAMPLES)
+                ),
+                "rise_rate": float(
+                    self.args.pop("humidity_rise_rate", DEFAULT_HUMIDITY_RISE_RATE)
+                ),
+                "max_rise": int(
+                    self.args.pop("humidity_max_rise", DEFAULT_HUMIDITY_MAX_RISE)
+                ),
+            }
+
         # experimental dimming features
         self.dimming: bool = False
         self.dim: dict[str, int | DimMethod] = {}
@@ -289,32 +1548,250 @@ class AutoMoLi(hass.Hass):  # type: ignore
                 "method": dim_method.value,
             }
 
-        # night mode settings
-        self.night_mode: dict[str, int | str] = {}
-        if night_mode := self.args.pop("night_mode", {}):
-            self.night_mode = await self.configure_night_mode(night_mode)
-
-        # on/off switch via input.boolean
-        self.disable_switch_entities: set[str] = self.listr(
-            self.args.pop("disable_switch_entities", set())
-        )
-        self.disable_switch_states: set[str] = self.listr(
-            self.args.pop("disable_switch_states", set(["off"]))
+        # local storage for learned data
+        self.storage = Path(
+            self.args.pop("storage_dir", Path(self.config_dir) / STORAGE_DIR)
         )
+        self.state_files: list[StateFile] = []
+
+        # rooms are spread over AppDaemon instances, each only runs its own ones
+        self.shard: ShardChannel | None = None
+        if shard := self.args.pop("shard", None):
+            shards = [str(name) for name in shard.get("shards", [])]
+            name = str(shard.get("name") or os.environ.get(SHARD_ENV, ""))
+            if name not in shards:
+                raise ValueError(
+                    f"shard '{name}' (from '{SHARD_ENV}' or 'name') is not one of "
+                    f"the configured shards: {shards}"
+                )
 
-        # store if an entity has been switched on by automoli
-        self.only_own_events: bool = bool(self.args.pop("only_own_events", False))
-        self._switched_on_by_automoli: set[str] = set()
+            if (owner := HashRing(shards).owner(self.room_name)) != name:
+                self.lg(f"{hl(self.room_name)} runs on shard {hl(owner)}")
+                return
 
-        self.disable_hue_groups: bool = self.args.pop("disable_hue_groups", False)
+            directory = Path(shard.get("channel", self.storage / SHARD_DIR))
+            if directory not in SHARDS:
+                SHARDS[directory] = ShardChannel(directory, name)
 
-        # eol of the old option name
-        if "disable_switch_entity" in self.args:
-            icon_alert = "⚠️"
-            self.lg("", icon=icon_alert)
-            self.lg(
-                f" please migrate {hl('disable_switch_entity')} to {hl('disable_switch_entities')}",
-                icon=icon_alert,
+            if not await SHARDS[directory].owns(self.room_name):
+                self.lg(
+                    f"{hl(self.room_name)} is run by another shard as well → left to it",
+                    level=logging.WARNING,
+                )
+                return
+
+            self.shard = SHARDS[directory]
+            self.shard.users += 1
+            self.shard_spread = float(shard.get("spread", DEFAULT_SHARD_SPREAD))
+
+        # runtime state snapshot to resume after restarts
+        self.persist_state: bool = bool(self.args.pop("persist_state", False))
+        self._off_deadline: float | None = None
+        self.runtime_file = StateFile(
+            self.storage / f"{self.name}.state.json", self.collect_runtime_state
+        )
+        if self.persist_state:
+            self.state_files.append(self.runtime_file)
+
+        # journal of the last decisions, queryable via the AppDaemon API
+        self.journal: deque[dict[str, Any]] = deque(
+            maxlen=int(self.args.pop("journal", DEFAULT_JOURNAL_SIZE))
+        )
+        # the journal via the AppDaemon API, needs its http component
+        self.journal_api: bool = bool(self.args.pop("journal_endpoint", False))
+        # net allocated memory blocks per decision
+        self.allocations: bool = bool(self.args.pop("allocations", False))
+
+        # typed log of all decisions and commands for offline analysis
+        self.event_log: EventLog | None = None
+        if event_log := self.args.pop("event_log", False):
+            event_log = event_log if isinstance(event_log, dict) else {}
+            self.event_log = EventLog(
+                self.storage / EVENT_LOG_DIR,
+                self.name,
+                max_bytes=int(
+                    float(event_log.pop("max_size", DEFAULT_EVENT_LOG_SIZE)) * 2**20
+                ),
+                keep=int(event_log.pop("keep", DEFAULT_EVENT_LOG_KEEP)),
+            )
+
+        # on-demand profiling of the handlers, started by an event or the endpoint
+        self.profiling: bool = bool(self.args.pop("profiling", False))
+        self.profiler: Profiler | None = None
+
+        # learn the delay from the gaps between motion events
+        self.adaptive_delay: dict[str, float | int] = {}
+        self.gaps: dict[str, GapHistogram] = {}
+        self._last_motion: float | None = None
+        if adaptive_delay := self.args.pop("adaptive_delay", {}):
+            adaptive_delay = adaptive_delay if isinstance(adaptive_delay, dict) else {}
+            self.adaptive_delay = {
+                "quantile": float(
+                    adaptive_delay.pop("quantile", DEFAULT_ADAPTIVE_QUANTILE)
+                ),
+                "min": int(adaptive_delay.pop("min", DEFAULT_ADAPTIVE_MIN)),
+                "max": int(adaptive_delay.pop("max", DEFAULT_ADAPTIVE_MAX)),
+            }
+            self.gaps_file = StateFile(
+                self.storage / f"{self.name}.delay.json", self.collect_gaps
+            )
+            self.state_files.append(self.gaps_file)
+            self.gaps = {
+                daytime: GapHistogram(counts)
+                for daytime, counts in (await self.gaps_file.load())
+                .get("gaps", {})
+                .items()
+            }
+
+        # switch on the lights in the room(s) most likely entered next
+        self.prelight: dict[str, Any] = {}
+        self.provisional: bool = False
+        self._tasks: set[asyncio.Future[Any]] = set()
+        if prelight := self.args.pop("prelight", {}):
+            prelight = prelight if isinstance(prelight, dict) else {}
+            self.prelight = {
+                "rooms": list(self.listr(prelight.pop("rooms", []), False)),
+                "learn": bool(prelight.pop("learn", True)),
+                "delay": int(prelight.pop("delay", DEFAULT_PRELIGHT_DELAY)),
+                "probability": float(
+                    prelight.pop("probability", DEFAULT_PRELIGHT_PROBABILITY)
+                ),
+                "max_rooms": int(prelight.pop("max_rooms", DEFAULT_PRELIGHT_ROOMS)),
+            }
+
+        # hysteresis for rooms cycling between on and off
+        self.flap: FlapDetector | None = None
+        if flap := self.args.pop("flap_suppression", {}):
+            flap = flap if isinstance(flap, dict) else {}
+            self.flap = FlapDetector(
+                window=int(flap.pop("window", DEFAULT_FLAP_WINDOW)),
+                count=int(flap.pop("count", DEFAULT_FLAP_COUNT)),
+                factor=float(flap.pop("factor", DEFAULT_FLAP_FACTOR)),
+                grace=int(flap.pop("grace", DEFAULT_FLAP_GRACE)),
+            )
+
+        # lights-on time & energy accounting per daytime
+        self.energy: dict[str, Any] = {}
+        # seconds with any light of the room on, energy of all lights
+        self.on_seconds: dict[str, float] = {}
+        self.energy_wh: dict[str, float] = {}
+        self._on_since: dict[str, float] = {}
+        self._room_on_since: float | None = None
+        self._energy_published: tuple[float, float] | None = None
+        if energy := self.args.pop("energy", {}):
+            energy = energy if isinstance(energy, dict) else {}
+            self.energy = {
+                "wattage": energy.pop("wattage", DEFAULT_WATTAGE),
+                "interval": int(energy.pop("interval", DEFAULT_ENERGY_INTERVAL)),
+            }
+            self.energy_file = StateFile(
+                self.storage / f"{self.name}.energy.json", self.collect_energy
+            )
+            self.state_files.append(self.energy_file)
+            counters = await self.energy_file.load()
+            self.on_seconds = dict(counters.get("on_seconds", {}))
+            self.energy_wh = dict(counters.get("energy_wh", {}))
+
+        # brightness/color temperature curves, compiled to daily lookup tables
+        self.circadian: dict[str, Any] = {}
+        self.circadian_tables: dict[str, array[int]] = {}
+        self._circadian_values: dict[str, int] = {}
+        if circadian := self.args.pop("circadian", {}):
+            circadian = circadian if isinstance(circadian, dict) else {}
+            self.circadian = {
+                "curves": {
+                    curve: {str(at): float(value) for at, value in points.items()}
+                    for curve in ("brightness", "color_temp")
+                    if (points := circadian.pop(curve, {}))
+                },
+                "interval": int(circadian.pop("interval", DEFAULT_CIRCADIAN_INTERVAL)),
+            }
+            await self.compile_circadian()
+
+        # brightness daytimes compiled into home assistant scenes
+        self.prestage_scenes: bool = bool(self.args.pop("prestage_scenes", False))
+        self.daytime_settings: dict[str, Any] = {}
+        self.staged: dict[str, str] = {}
+
+        # switch on from cached state first, check & book-keep afterwards
+        self.low_latency: bool = bool(self.args.pop("low_latency", False))
+        self._cache: dict[str, Any] = {}
+        self._plans: dict[Any, list[tuple[str, dict[str, Any]]] | None] = {}
+        self._fast_calls: list[asyncio.Future[Any]] = []
+        self.latency: deque[float] = deque(maxlen=LATENCY_HISTORY)
+
+        # exclude stuck/silent motion sensors
+        self.sensor_health: dict[str, int] = {}
+        self.health: dict[str, SensorHealth] = {}
+        if sensor_health := self.args.pop("sensor_health", {}):
+            sensor_health = sensor_health if isinstance(sensor_health, dict) else {}
+            self.sensor_health = {
+                "stuck": int(sensor_health.pop("stuck", DEFAULT_SENSOR_STUCK)),
+                "silent": int(sensor_health.pop("silent", DEFAULT_SENSOR_SILENT)),
+                "interval": int(
+                    sensor_health.pop("interval", DEFAULT_SENSOR_CHECK_INTERVAL)
+                ),
+            }
+
+        # night mode settings
+        self.night_mode: dict[str, int | str] = {}
+        if night_mode := self.args.pop("night_mode", {}):
+            self.night_mode = await self.configure_night_mode(night_mode)
+
+        # on/off switch via input.boolean
+        self.disable_switch_entities: set[str] = self.listr(
+            self.args.pop("disable_switch_entities", set())
+        )
+        self.disable_switch_states: set[str] = self.listr(
+            self.args.pop("disable_switch_states", set(["off"]))
+        )
+
+        # store if an entity has been switched on by automoli
+        self.only_own_events: bool = bool(self.args.pop("only_own_events", False))
+        self._switched_on_by_automoli: set[str] = set()
+
+        # pause lights controlled manually, recognized by the context of changes
+        self.manual_override: int = int(
+            self.args.pop("manual_override", DEFAULT_MANUAL_OVERRIDE)
+        )
+        self.own_contexts = ContextIds()
+        self._own_pending: dict[str, float] = {}
+        self._manual_until: dict[str, float] = {}
+
+        # timeouts, retries & circuit breakers for service calls
+        self.service_timeout = float(
+            self.args.pop("service_timeout", DEFAULT_SERVICE_TIMEOUT)
+        )
+        self.service_retries = int(
+            self.args.pop("service_retries", DEFAULT_SERVICE_RETRIES)
+        )
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+        # direct, pipelined websocket connection instead of appdaemon's plugin
+        self.websocket: HAWebsocket | None = None
+        if (websocket := self.args.pop("websocket", {})) and self.shadow is None:
+            if not isinstance(websocket, dict) or not (
+                websocket.get("url") and websocket.get("token")
+            ):
+                raise ValueError(
+                    "websocket needs the 'url' of home assistant's websocket api "
+                    "and a long-lived access 'token'"
+                )
+            url, token = str(websocket["url"]), str(websocket["token"])
+            if url not in WEBSOCKETS:
+                WEBSOCKETS[url] = HAWebsocket(url, token)
+            self.websocket = WEBSOCKETS[url]
+            self.websocket.users += 1
+
+        self.disable_hue_groups: bool = self.args.pop("disable_hue_groups", False)
+
+        # eol of the old option name
+        if "disable_switch_entity" in self.args:
+            icon_alert = "⚠️"
+            self.lg("", icon=icon_alert)
+            self.lg(
+                f" please migrate {hl('disable_switch_entity')} to {hl('disable_switch_entities')}",
+                icon=icon_alert,
             )
             self.lg("", icon=icon_alert)
             self.args.pop("disable_switch_entity")
@@ -324,7 +1801,7 @@ class AutoMoLi(hass.Hass):  # type: ignore
         self.active: dict[str, int | str] = {}
 
         # entity lists for initial discovery
-        states = await self.get_state()
+        states = await self.read_state()
 
         self.handle_turned_off: str | None = None
 
@@ -341,6 +1818,12 @@ class AutoMoLi(hass.Hass):  # type: ignore
                     )
                 )
 
+        # cached light metadata, refreshed on attribute/registry changes
+        self.entity_meta: dict[str, EntityMeta] = {
+            light: EntityMeta.from_state(light, states.get(light))
+            for light in self.lights
+        }
+
         # sensors
         self.sensors: dict[str, Any] = {}
 
@@ -354,18 +1837,62 @@ class AutoMoLi(hass.Hass):  # type: ignore
             )
         )
 
+        # door/window contacts for the "sealed room" presence
+        self.sealed: bool = False
+        self.doors_open: set[str] = set()
+        self.sensors[EntityType.DOOR_WINDOW.idx] = self.listr(
+            self.args.pop("door_window", None)
+        )
+        if self.args.pop("sealed_room", False) and not (
+            self.sensors[EntityType.DOOR_WINDOW.idx]
+        ):
+            self.sensors[EntityType.DOOR_WINDOW.idx] = set(
+                await self.find_sensors(
+                    EntityType.DOOR_WINDOW.prefix, self.room_name, states
+                )
+            )
+        if not self.sensors[EntityType.DOOR_WINDOW.idx]:
+            del self.sensors[EntityType.DOOR_WINDOW.idx]
+
+        # zones: light subsets switched by their own motion sensors & timer
+        self.zones: dict[str, Zone] = {
+            str(name): Zone(
+                name=str(name),
+                lights=self.listr(zone.get("lights")),
+                motion=self.listr(zone.get("motion")),
+                delay=int(zone["delay"]) if "delay" in zone else None,
+            )
+            for name, zone in (self.args.pop("zones", None) or {}).items()
+        }
+        self.zone_of: dict[str, Zone] = {
+            sensor: zone for zone in self.zones.values() for sensor in zone.motion
+        }
+        zoned = {light for zone in self.zones.values() for light in zone.lights}
+        self.all_lights: set[str] = set(self.lights) | zoned
+        for light in zoned - self.entity_meta.keys():
+            self.entity_meta[light] = EntityMeta.from_state(light, states.get(light))
+
+        # the room switches the lights & listens to the sensors left over
+        if self.zones:
+            self.lights = set(self.lights) - zoned
+            self.sensors[EntityType.MOTION.idx] = (
+                set(self.sensors[EntityType.MOTION.idx]) - self.zone_of.keys()
+            )
+
         self.room = Room(
             name=self.room_name,
             room_lights=self.lights,
             motion=self.sensors[EntityType.MOTION.idx],
-            door_window=set(),
+            door_window=self.sensors.get(EntityType.DOOR_WINDOW.idx, set()),
             temperature=set(),
             push_data=dict(),
             appdaemon=self.get_ad_api(),
         )
 
         # requirements check
-        if not self.lights or not self.sensors[EntityType.MOTION.idx]:
+        if not self.zones and (
+            not self.lights or not self.sensors[EntityType.MOTION.idx]
+        ):
             self.lg("")
             self.lg(
                 f"{hl('No lights/sensors')} given and none found with name: "
@@ -381,7 +1908,9 @@ class AutoMoLi(hass.Hass):  # type: ignore
         # enumerate optional sensors & disable optional features if sensors are not available
         for sensor_type in SENSORS_OPTIONAL:
 
-            if sensor_type in self.thresholds and self.thresholds[sensor_type]:
+            if (sensor_type in self.thresholds and self.thresholds[sensor_type]) or (
+                sensor_type == EntityType.HUMIDITY.idx and self.humidity_trend
+            ):
                 self.sensors[sensor_type] = self.listr(
                     self.args.pop(sensor_type, None)
                 ) or await self.find_sensors(
@@ -390,6 +1919,10 @@ class AutoMoLi(hass.Hass):  # type: ignore
 
                 self.lg(f"{self.sensors[sensor_type] = }", level=logging.DEBUG)
 
+                # trend-only humidity configuration
+                if not self.thresholds[sensor_type]:
+                    del self.thresholds[sensor_type]
+
             else:
                 self.lg(
                     f"No {sensor_type} sensors → disabling features based on {sensor_type}"
@@ -440,6 +1973,114 @@ class AutoMoLi(hass.Hass):  # type: ignore
                     )
                 )
 
+        # zone sensors switch the zone lights only
+        for sensor in self.zone_of:
+            if all([self.states["motion_on"], self.states["motion_off"]]):
+                listener.add(self.listen_state(self.zone_motion, entity_id=sensor))
+            else:
+                listener.add(
+                    self.listen_event(
+                        self.zone_event, event=EVENT_MOTION_XIAOMI, entity_id=sensor
+                    )
+                )
+
+        # account the time lights are on, published in batches
+        if self.energy:
+            self._on_since = {
+                light: monotonic()
+                for light in self.all_lights
+                if (states.get(light) or {}).get("state") == "on"
+            }
+            self._room_on_since = monotonic() if self._on_since else None
+            listener.add(
+                self.run_every(
+                    self.publish_energy,
+                    f"now+{self.energy['interval']}",
+                    self.energy["interval"],
+                )
+            )
+
+        # recompile the curves daily (sunrise/sunset move) & follow them while on
+        if self.circadian:
+            listener.add(self.run_daily(self.compile_circadian, time(0, 0, 30)))
+            listener.add(
+                self.run_every(
+                    self.update_circadian,
+                    f"now+{self.circadian['interval']}",
+                    self.circadian["interval"],
+                )
+            )
+
+        # motion sensor health, checked from in-memory timestamps only
+        if self.sensor_health:
+            self.health = {
+                sensor: SensorHealth(await self.read_state(sensor), monotonic())
+                for sensor in self.sensors[EntityType.MOTION.idx]
+            }
+            listener.add(
+                self.run_every(
+                    self.check_sensor_health,
+                    f"now+{self.sensor_health['interval']}",
+                    self.sensor_health["interval"],
+                )
+            )
+
+        # keep light metadata up to date & classify light changes as own or manual
+        for light in self.all_lights:
+            listener.add(
+                self.listen_event(
+                    self.light_changed, event="state_changed", entity_id=light
+                )
+            )
+        listener.add(
+            self.listen_event(
+                self.entity_registry_updated, event="entity_registry_updated"
+            )
+        )
+
+        if self.profiling:
+            listener.add(self.listen_event(self.profile_requested, EVENT_PROFILE))
+
+        # scenes are lost on home assistant restarts → staged again on reconnect
+        if self.prestage_scenes:
+            listener.add(self.stage_scenes())
+            listener.add(self.listen_event(self.restage_scenes, "plugin_started"))
+
+        # cache the states deciding about the fast path, kept current by their events
+        cached: set[str] = set()
+        if self.low_latency:
+            cached = {
+                *self.lights,
+                *self.disable_switch_entities,
+                *self.sensors.get(EntityType.ILLUMINANCE.idx, []),
+            }
+            if self.night_mode:
+                cached.add(str(self.night_mode["entity"]))
+
+        # an unreachable websocket falls back to appdaemon's plugin
+        if self.websocket:
+            await self.connect_websocket(cached)
+
+        for entity in cached:
+            self._cache[entity] = await self.read_state(entity)
+            if not self.websocket:
+                listener.add(self.listen_state(self.cache_state, entity_id=entity))
+
+        # track opened doors/windows to detect a sealed room
+        for sensor in self.room.door_window:
+            if await self.read_state(sensor) == self.states["door_window_open"]:
+                self.doors_open.add(sensor)
+            listener.add(self.listen_state(self.door_window_changed, entity_id=sensor))
+
+        # feed the humidity trend detectors with every new sample
+        if self.humidity_trend:
+            for sensor in self.sensors.get(EntityType.HUMIDITY.idx, set()):
+                self.humidity_trends[sensor] = HumidityTrend(**self.humidity_trend)
+                await self.humidity_changed(
+                    sensor, "state", None, await self.read_state(sensor), {}
+                )
+                listener.add(self.listen_state(self.humidity_changed, entity_id=sensor))
+
         self.args.update(
             {
                 "room": self.room_name.capitalize(),
@@ -447,162 +2088,1549 @@ class AutoMoLi(hass.Hass):  # type: ignore
                 "active_daytime": self.active_daytime,
                 "daytimes": daytimes,
                 "lights": self.lights,
+                "zones": {
+                    name: {
+                        "lights": zone.lights,
+                        "motion": zone.motion,
+                        "delay": zone.delay,
+                    }
+                    for name, zone in self.zones.items()
+                },
                 "dim": self.dim,
+                "adaptive_delay": self.adaptive_delay,
+                "prelight": self.prelight,
+                "flap_suppression": {
+                    "window": self.flap.window,
+                    "factor": self.flap.factor,
+                    "grace": self.flap.grace,
+                }
+                if self.flap
+                else {},
                 "sensors": self.sensors,
                 "disable_hue_groups": self.disable_hue_groups,
                 "only_own_events": self.only_own_events,
+                "manual_override": self.manual_override,
+                "service_timeout": self.service_timeout,
+                "service_retries": self.service_retries,
+                "persist_state": self.persist_state,
+                "sensor_health": self.sensor_health,
+                "energy": self.energy,
+                "circadian": self.circadian,
+                "shadow": self.shadow is not None,
+                "low_latency": self.low_latency,
+                "prestage_scenes": self.prestage_scenes,
+                "websocket": self.websocket.url if self.websocket else None,
+                "allocations": self.allocations,
                 "loglevel": self.loglevel,
             }
         )
 
-        if self.thresholds:
-            self.args.update({"thresholds": self.thresholds})
+        if self.thresholds:
+            self.args.update({"thresholds": self.thresholds})
+
+        if self.humidity_trend:
+            self.args.update({"humidity_trend": self.humidity_trend})
+
+        # add night mode to config if enabled
+        if self.night_mode:
+            self.args.update({"night_mode": self.night_mode})
+
+        # add disable entity to config if given
+        if self.disable_switch_entities:
+            self.args.update({"disable_switch_entities": self.disable_switch_entities})
+            self.args.update({"disable_switch_states": self.disable_switch_states})
+
+        # show parsed config
+        self.show_info(self.args)
+
+        # the live instance of this room stays the one known to others
+        if self.shadow is None:
+            ROOMS[self.room_name] = self
+
+        # entities discovered by rooms on other shards as well
+        if self.shard and self.shadow is None:
+            entities = {
+                *self.all_lights,
+                *[sensor for sensors in self.sensors.values() for sensor in sensors],
+            }
+            self.shard.publish(self.room_name, entities)
+            listener.add(
+                self.run_every(
+                    self.check_shard, f"now+{SHARD_REFRESH_SEC}", SHARD_REFRESH_SEC
+                )
+            )
+            for entity, room in (
+                await self.shard.claims(self.room_name, entities)
+            ).items():
+                self.lg(
+                    f"{hl(entity)} is used by {hl(room)} on another shard as well",
+                    level=logging.WARNING,
+                )
+
+        if self.journal_api:
+            await self.register_endpoint(self.journal_endpoint, f"automoli_{self.name}")
+
+        await asyncio.gather(*listener)
+
+        # resume from the last runtime snapshot
+        if not await self.restore_state():
+            await self.refresh_timer()
+
+    async def check_shard(self, _: dict[str, Any] | None = None) -> None:
+        """stop if another shard started to run this room and the ring prefers it"""
+
+        if self.shard and not await self.shard.owns(self.room_name):
+            self.lg(
+                f"{hl(self.room_name)} is run by another shard as well → left to it",
+                level=logging.WARNING,
+            )
+            await self.stop_app(self.name)
+
+    async def switch_daytime(self, kwargs: dict[str, Any]) -> None:
+        """Set new light settings according to daytime."""
+
+        daytime = kwargs.get("daytime")
+
+        # house-wide order of the simultaneous switches of all shards
+        if (
+            self.shard
+            and daytime is not None
+            and not kwargs.get("initial")
+            and not kwargs.get("spread")
+        ):
+            offset = await self.shard.offset(self.room_name, self.shard_spread)
+            await self.run_in(self.switch_daytime, offset, daytime=daytime, spread=True)
+            return
+
+        if daytime is not None:
+            # attribute the lights-on time so far to the previous daytime
+            self.account_lights()
+
+            self.active = daytime
+            self._plans.clear()
+            if self.prestage_scenes and not kwargs.get("initial"):
+                self.background(self.stage_scenes([str(daytime["daytime"])]))
+            if not kwargs.get("initial"):
+                self.save_state()
+
+                delay = daytime["delay"]
+                light_setting = daytime["light_setting"]
+                if light_setting == CIRCADIAN:
+                    is_scene = False
+                elif isinstance(light_setting, str):
+                    is_scene = True
+                    # if its a ha scene, remove the "scene." part
+                    if "." in light_setting:
+                        light_setting = (light_setting.split("."))[1]
+                else:
+                    is_scene = False
+
+                self.lg(
+                    f"{stack()[0][3]}: {self.transition_on_daytime_switch = }",
+                    level=logging.DEBUG,
+                )
+
+                action_done = "set"
+
+                if self.transition_on_daytime_switch and any(
+                    [await self.read_state(light) == "on" for light in self.lights]
+                ):
+                    await self.lights_on(force=True)
+                    action_done = "activated"
+
+                self.lg(
+                    f"{action_done} daytime {hl(daytime['daytime'])} → "
+                    f"{'scene' if is_scene else 'brightness'}: {hl(light_setting)}"
+                    f"{'' if is_scene or light_setting == CIRCADIAN else '%'}, "
+                    f"delay: {hl(natural_time(delay))}",
+                    icon=DAYTIME_SWITCH_ICON,
+                )
+
+    @journaled
+    async def motion_cleared(
+        self, entity: str, attribute: str, old: str, new: str, _: dict[str, Any]
+    ) -> None:
+        """wrapper for motion sensors that do not push a certain event but.
+        instead the default HA `state_changed` event is used for presence detection
+        schedules the callback to switch the lights off after a `state_changed` callback
+        of a motion sensors changing to "cleared" is received
+        """
+
+        # starte the timer if motion is cleared
+        self.lg(
+            f"{stack()[0][3]}: {entity} changed {attribute} from {old} to {new}",
+            level=logging.DEBUG,
+        )
+
+        self.sensor_seen(entity, new)
+
+        if await self.motion_sensors_off():
+            # all motion sensors off, starting timer
+            self._last_motion = monotonic()
+            await self.refresh_timer()
+        else:
+            # cancel scheduled callbacks
+            await self.clear_handles()
+
+    @journaled
+    async def motion_detected(
+        self, entity: str, attribute: str, old: str, new: str, kwargs: dict[str, Any]
+    ) -> None:
+        """wrapper for motion sensors that do not push a certain event but.
+        instead the default HA `state_changed` event is used for presence detection
+        maps the `state_changed` callback of a motion sensors changing to "detected"
+        to the `event` callback`
+        """
+
+        self.lg(
+            f"{stack()[0][3]}: {entity} changed {attribute} from {old} to {new}",
+            level=logging.DEBUG,
+        )
+
+        fast = self.low_latency and self.fast_on()
+
+        self.sensor_seen(entity, new)
+
+        # cancel scheduled callbacks
+        await self.clear_handles()
+
+        self.lg(
+            f"{stack()[0][3]}: handles cleared and cancelled all scheduled timers"
+            f" | {self.dimming = }",
+            level=logging.DEBUG,
+        )
+
+        # calling motion event handler
+        data: dict[str, Any] = {
+            "entity_id": entity,
+            "new": new,
+            "old": old,
+            "fast": fast,
+        }
+        await self.motion_event("state_changed_detection", data, kwargs)
+
+    def wattage(self, light: str) -> float:
+        if isinstance(wattage := self.energy.get("wattage"), dict):
+            return float(wattage.get(light, DEFAULT_WATTAGE))
+        return float(wattage or DEFAULT_WATTAGE)
+
+    def account_lights(
+        self, light: str | None = None, state: str | None = None
+    ) -> None:
+        """add the time since the last accounting of lights on to the counters"""
+
+        if not self.energy:
+            return
+
+        now = monotonic()
+        daytime = str(self.active.get("daytime"))
+
+        if self._room_on_since is not None:
+            self.on_seconds[daytime] = (
+                self.on_seconds.get(daytime, 0) + now - self._room_on_since
+            )
+            self._room_on_since = now
+
+        for entity, since in list(self._on_since.items()):
+            if light and entity != light:
+                continue
+            self.energy_wh[daytime] = (
+                self.energy_wh.get(daytime, 0)
+                + (now - since) * self.wattage(entity) / 3600
+            )
+            self._on_since[entity] = now
+
+        if light and state != "on":
+            self._on_since.pop(light, None)
+        elif light:
+            self._on_since.setdefault(light, now)
+
+        # the room is on while any of its lights is on
+        if not self._on_since:
+            self._room_on_since = None
+        elif self._room_on_since is None:
+            self._room_on_since = now
+
+    def collect_energy(self) -> dict[str, Any]:
+        return {
+            "version": 2,
+            "on_seconds": dict(self.on_seconds),
+            "energy_wh": dict(self.energy_wh),
+        }
+
+    async def publish_energy(self, _: dict[str, Any] | None = None) -> None:
+        """publish lights-on time & energy per daytime as home assistant sensors"""
+
+        self.account_lights()
+
+        totals = (sum(self.on_seconds.values()), sum(self.energy_wh.values()))
+        if totals == self._energy_published:
+            return
+
+        self._energy_published = totals
+        self.energy_file.schedule()
+
+        name = f"{APP_NAME} {self.room_name.capitalize()}"
+        await asyncio.gather(
+            self.set_state(
+                f"sensor.automoli_{self.room_name}_on_time",
+                state=round(totals[0] / 3600, 3),
+                attributes={
+                    "friendly_name": f"{name} lights on",
+                    "unit_of_measurement": "h",
+                    "state_class": "total_increasing",
+                    "icon": "mdi:lightbulb-on-outline",
+                    **{
+                        daytime: round(seconds / 3600, 3)
+                        for daytime, seconds in self.on_seconds.items()
+                    },
+                },
+            ),
+            self.set_state(
+                f"sensor.automoli_{self.room_name}_energy",
+                state=round(totals[1] / 1000, 4),
+                attributes={
+                    "friendly_name": f"{name} light energy",
+                    "unit_of_measurement": "kWh",
+                    "device_class": "energy",
+                    "state_class": "total_increasing",
+                    **{
+                        daytime: round(energy_wh / 1000, 4)
+                        for daytime, energy_wh in self.energy_wh.items()
+                    },
+                },
+            ),
+        )
+
+    async def compile_circadian(self, _: dict[str, Any] | None = None) -> None:
+        """resolve today's curve points & compile them into lookup tables"""
+
+        for curve, points in self.circadian["curves"].items():
+            minutes: dict[int, float] = {}
+            for starttime, value in points.items():
+                if starttime.count(":") == 1:
+                    starttime += ":00"
+                at = await self.parse_time(starttime)
+                minutes[at.hour * 60 + at.minute] = value
+            self.circadian_tables[curve] = compile_curve(minutes)
+
+        self.lg(
+            f"{stack()[0][3]}: compiled {list(self.circadian_tables)} curves",
+            level=logging.DEBUG,
+        )
+
+    async def circadian_values(self) -> dict[str, int]:
+        """current curve values, a lookup in the compiled tables"""
+
+        now = await self.get_now()
+        minute = now.hour * 60 + now.minute
+        return {curve: table[minute] for curve, table in self.circadian_tables.items()}
+
+    def circadian_calls(
+        self, lights: Iterable[str], values: dict[str, int], **data: Any
+    ) -> list[Coroutine[Any, Any, Any]]:
+        """batched service calls bringing lights to the given curve values"""
+
+        # one call per capability: switches, dimmable lights, color temperature lights
+        groups: dict[str, list[str]] = {"switch": [], "dim": [], "color_temp": []}
+        for entity in lights:
+            if entity.startswith("switch."):
+                groups["switch"].append(entity)
+            elif "color_temp" in values and "color_temp" in (
+                self.entity_meta[entity].supported_color_modes
+            ):
+                groups["color_temp"].append(entity)
+            else:
+                groups["dim"].append(entity)
+
+        if "brightness" in values:
+            data["brightness_pct"] = values["brightness"]
+
+        calls = []
+        if groups["switch"]:
+            calls.append(
+                self.service_call("homeassistant/turn_on", entity_id=groups["switch"])
+            )
+        if groups["dim"]:
+            calls.append(
+                self.service_call("light/turn_on", entity_id=groups["dim"], **data)
+            )
+        if groups["color_temp"]:
+            calls.append(
+                self.service_call(
+                    "light/turn_on",
+                    entity_id=groups["color_temp"],
+                    color_temp_kelvin=values["color_temp"],
+                    **data,
+                )
+            )
+
+        return calls
+
+    async def update_circadian(self, _: dict[str, Any] | None = None) -> None:
+        """follow the curves with all lights that are on, in a few batched calls"""
+
+        light_setting = (
+            self.night_mode.get("light")
+            if await self.night_mode_active()
+            else self.active.get("light_setting")
+        )
+        if light_setting != CIRCADIAN or await self.is_disabled():
+            return
+
+        # nothing to do while the curves are flat
+        values = await self.circadian_values()
+        if values == self._circadian_values:
+            return
+        self._circadian_values = values
+
+        lights = [
+            light
+            for light in self.all_lights
+            if await self.read_state(light) == "on"
+            and not light.startswith("switch.")
+            and not self.manually_controlled(light)
+        ]
+        if lights:
+            await asyncio.gather(
+                *self.circadian_calls(
+                    lights, values, transition=CIRCADIAN_TRANSITION_SEC
+                )
+            )
+
+    async def motion_sensors_off(self) -> bool:
+        """check if all healthy motion sensors are off"""
+        return all(
+            [
+                await self.read_state(sensor) == self.states["motion_off"]
+                for sensor in self.sensors[EntityType.MOTION.idx]
+                if sensor not in self.health or self.health[sensor].status == "ok"
+            ]
+        )
+
+    def sensor_seen(self, sensor: str, state: str | None) -> None:
+        """update the health of a motion sensor on one of its events"""
+
+        if not (health := self.health.get(sensor)):
+            return
+
+        health.seen(state, monotonic())
+
+        if health.status != "ok":
+            self.lg(f"{hl(sensor)} is back → using it again")
+            health.status = "ok"
+            self.background(self.publish_sensor_health())
+
+    async def check_sensor_health(self, _: dict[str, Any] | None = None) -> None:
+        """flag stuck/silent motion sensors and exclude them from occupancy"""
+
+        now = monotonic()
+        changed = False
+
+        for sensor, health in self.health.items():
+            status = health.check(
+                now,
+                self.sensor_health["stuck"],
+                self.sensor_health["silent"],
+                self.states["motion_on"],
+            )
+            if status != health.status:
+                self.lg(
+                    f"{hl(sensor)} is {hl(status)} → "
+                    f"{'ignoring' if status != 'ok' else 'using'} it"
+                    f" | {health.state = } | {health.rate = :.2f}/h"
+                )
+                health.status = status
+                changed = True
+
+        if not changed:
+            return
+
+        await self.publish_sensor_health()
+
+        # a stuck sensor may have been the last one keeping the lights on
+        if (
+            self.states["motion_off"]
+            and not self.room.handles_automoli
+            and await self.motion_sensors_off()
+        ):
+            await self.refresh_timer()
+
+    async def publish_sensor_health(self) -> None:
+        """publish the status of the motion sensors as home assistant entity"""
+
+        degraded = any(health.status != "ok" for health in self.health.values())
+
+        await self.set_state(
+            f"sensor.automoli_{self.room_name}_motion_health",
+            state="degraded" if degraded else "ok",
+            attributes={
+                "friendly_name": f"{APP_NAME} {self.room_name.capitalize()} motion",
+                "icon": "mdi:motion-sensor-off" if degraded else "mdi:motion-sensor",
+                **{sensor: health.status for sensor, health in self.health.items()},
+            },
+        )
+
+    @journaled
+    async def door_window_changed(
+        self, entity: str, attribute: str, old: str, new: str, _: dict[str, Any]
+    ) -> None:
+        """unseal the room if a door/window is opened."""
+
+        self.lg(
+            f"{stack()[0][3]}: {entity} changed {attribute} from {old} to {new}"
+            f" | {self.sealed = }",
+            level=logging.DEBUG,
+        )
+
+        if new != self.states["door_window_open"]:
+            self.doors_open.discard(entity)
+            return
+
+        self.doors_open.add(entity)
+
+        if self.sealed:
+            self.sealed = False
+            self.lg(
+                f"{hl(self.room.name.capitalize())} unsealed by {hl(entity)} → "
+                f"starting timer ({hl(natural_time(self.current_delay()))})",
+                level=logging.DEBUG,
+            )
+            await self.refresh_timer()
+
+    async def light_changed(
+        self, event: str, data: dict[str, Any], _: dict[str, Any]
+    ) -> None:
+        """classify light state changes as own or manual by their context."""
+
+        entity = data.get("entity_id", "")
+        new_state = data.get("new_state") or {}
+        old_state = data.get("old_state") or {}
+        context = new_state.get("context") or {}
+
+        self.update_entity_meta(entity, new_state)
+
+        if self.energy and new_state.get("state") != old_state.get("state"):
+            self.account_lights(entity, new_state.get("state"))
+
+        # lights are switched by the live instance, not by us
+        if not self.manual_override or self.shadow is not None:
+            return
+
+        if context.get("id") in self.own_contexts or (
+            context.get("parent_id") in self.own_contexts
+        ):
+            return
+
+        # result of an own call not returned yet or without a context
+        if (
+            pending := self._own_pending.get(entity)
+        ) and monotonic() - pending <= CONTEXT_SETTLE_SEC:
+            if context_id := context.get("id"):
+                self.own_contexts.add(context_id)
+            return
+
+        # attribute updates only (e.g. polling)
+        if new_state.get("state") == old_state.get("state") and (
+            new_state.get("attributes", {}).get("brightness")
+            == old_state.get("attributes", {}).get("brightness")
+        ):
+            return
+
+        self._manual_until[entity] = monotonic() + self.manual_override
+        self._switched_on_by_automoli.discard(entity)
+        self.save_state()
+
+        self.lg(
+            f"{hl(entity)} switched {hl(new_state.get('state'))} manually → "
+            f"pausing for {hl(natural_time(self.manual_override))}"
+            f" | context: {context}"
+        )
+
+    def update_entity_meta(self, entity: str, state: Mapping[str, Any]) -> None:
+        """refresh the cached metadata if one of its attributes changed"""
+
+        attributes = state.get("attributes") or {}
+        if (meta := self.entity_meta.get(entity)) and (
+            attributes.get("friendly_name", entity) == meta.friendly_name
+            and bool(attributes.get("is_hue_group", False)) == meta.is_hue_group
+            and frozenset(attributes.get("supported_color_modes") or [])
+            == meta.supported_color_modes
+        ):
+            return
+
+        self.entity_meta[entity] = EntityMeta.from_state(entity, state)
+        self._plans.clear()
+        self.lg(f"{stack()[0][3]}: {self.entity_meta[entity] = }", level=logging.DEBUG)
+
+    async def entity_registry_updated(
+        self, event: str, data: dict[str, Any], _: dict[str, Any]
+    ) -> None:
+        """re-read the metadata of a renamed/changed light."""
+
+        if (entity := data.get("entity_id")) in self.entity_meta:
+            self.update_entity_meta(
+                entity, await self.read_state(entity, attribute="all") or {}
+            )
+
+    @property
+    def lights_dimmable(self) -> list[str]:
+        return [light for light in self.lights if self.entity_meta[light].dimmable]
+
+    @property
+    def lights_undimmable(self) -> list[str]:
+        return [light for light in self.lights if not self.entity_meta[light].dimmable]
+
+    def manually_controlled(self, entity: str) -> bool:
+        return bool((until := self._manual_until.get(entity)) and monotonic() < until)
+
+    async def service_call(
+        self, service: str, idempotent: bool = True, **data: Any
+    ) -> Any:
+        """call a service with timeout, retries and a circuit breaker per entity.
+
+        The context of the call is remembered to recognize own state changes.
+        Returns `FAILED` if the call failed or was skipped, split batches fail if any
+        of their entities fails.
+        """
+
+        # calls without entities (hue groups, scene creation) get their own breakers
+        entity_id = data.get("entity_id")
+        targets = [
+            str(target)
+            for target in (
+                entity_id
+                if isinstance(entity_id, list)
+                else [
+                    entity_id
+                    or data.get("group_name")
+                    or data.get("scene_id")
+                    or service
+                ]
+            )
+        ]
+
+        # entities with an open circuit are left out of batched calls
+        now = monotonic()
+        allowed: list[str] = []
+        for target in targets:
+            if self.breakers.setdefault(target, CircuitBreaker()).allow(now):
+                allowed.append(target)
+                continue
+            self.lg(
+                f"{stack()[0][3]}: skipping {service} for {target} → circuit open",
+                level=logging.DEBUG,
+            )
+            self.act(f"skipped:{target}")
+
+        if not allowed:
+            return FAILED
+        if len(allowed) < len(targets):
+            data = {**data, "entity_id": allowed}
+        target = ", ".join(allowed)
+
+        if self.manual_override:
+            now = monotonic()
+            entities = entity_id if isinstance(entity_id, list) else [entity_id]
+            for entity in [e for e in entities if e in self.all_lights] or self.lights:
+                self._own_pending[entity] = now
+
+        # first command of a motion decision
+        if (
+            (record := DECISION.get()) is not None
+            and record["handler"] in ("motion_event", "motion_detected")
+            and "latency_ms" not in record
+        ):
+            record["latency_ms"] = round(
+                (datetime.now().timestamp() - record["ts"]) * 1000, 3
+            )
+            self.latency.append(record["latency_ms"])
+
+        attempts = 1 + (self.service_retries if idempotent else 0)
+        error: Any = None
+
+        for attempt in range(attempts):
+
+            if attempt:
+                await asyncio.sleep(
+                    SERVICE_RETRY_BACKOFF_SEC
+                    * 2 ** (attempt - 1)
+                    * (1 + random.random())  # nosec
+                )
+
+            try:
+                result = await asyncio.wait_for(
+                    self.websocket.call_service(service, **data)
+                    if self.websocket
+                    else self.call_service(service, **data),
+                    self.service_timeout,
+                )
+            except asyncio.TimeoutError:
+                error = f"no response within {self.service_timeout}s"
+                continue
+            except Exception as exception:  # pylint: disable=broad-except
+                error = exception
+                continue
+
+            if isinstance(result, dict) and result.get("success") is False:
+                error = result.get("error", result)
+                continue
+
+            closed = False
+            for entity in allowed:
+                if (breaker := self.breakers[entity]).is_open:
+                    self.lg(f"{hl(entity)} is responding again → circuit closed")
+                    closed = True
+                breaker.success()
+            if closed:
+                self.background(self.publish_service_health())
+
+            for context_id in context_ids(result):
+                self.own_contexts.add(context_id)
+
+            if self.event_log:
+                self.log_command(EventKind.COMMAND, service, target, data)
+
+            return result
+
+        # a batch fails as a whole → call its entities one by one, so only the
+        # failing ones count against their breakers
+        if len(allowed) > 1:
+            self.lg(
+                f"{service} for {target} failed: {error} → calling them one by one",
+                level=logging.DEBUG,
+            )
+            results = await asyncio.gather(
+                *[
+                    self.service_call(
+                        service, idempotent, **{**data, "entity_id": entity}
+                    )
+                    for entity in allowed
+                ]
+            )
+            return FAILED if FAILED in results else results
+
+        if (breaker := self.breakers[target]).failure(monotonic()):
+            self.lg(
+                f"{hl(target)} failed {breaker.failures} times → skipping it for "
+                f"{hl(natural_time(breaker.cooldown))} | open breakers: "
+                f"{self.open_breakers}",
+                level=logging.WARNING,
+            )
+            self.background(self.publish_service_health())
+
+        self.lg(
+            f"{service} for {target} failed after {attempts} attempt(s): {error}",
+            level=logging.WARNING,
+        )
+        self.act(f"failed:{target}")
+        if self.event_log:
+            self.log_command(EventKind.FAILED, service, target, data)
+
+        return FAILED
+
+    def log_command(
+        self, kind: EventKind, service: str, target: str, data: dict[str, Any]
+    ) -> None:
+        """add a service call to the event log, with the brightness it sets"""
+
+        record = DECISION.get()
+        value = data.get("brightness_pct", data.get("brightness"))
+        self.event_log.append(  # type: ignore
+            datetime.now().timestamp(),
+            kind,
+            record["handler"] if record else "",
+            target,
+            service,
+            float(value) if isinstance(value, (int, float)) else float("nan"),
+        )
+
+    @property
+    def latency_stats(self) -> dict[str, float]:
+        """motion-to-command latencies of the last decisions"""
+        if not self.latency:
+            return {}
+        latencies = sorted(self.latency)
+        return {
+            "samples": len(latencies),
+            "median": latencies[len(latencies) // 2],
+            "p95": latencies[int(len(latencies) * 0.95)],
+        }
+
+    @property
+    def open_breakers(self) -> int:
+        return sum(breaker.is_open for breaker in self.breakers.values())
+
+    async def publish_service_health(self) -> None:
+        """publish the open circuit breakers as home assistant entity"""
+
+        degraded = bool(self.open_breakers)
+
+        await self.set_state(
+            f"sensor.automoli_{self.room_name}_service_health",
+            state="degraded" if degraded else "ok",
+            attributes={
+                "friendly_name": f"{APP_NAME} {self.room_name.capitalize()} services",
+                "icon": "mdi:lightbulb-alert" if degraded else "mdi:lightbulb-outline",
+                "open_breakers": self.open_breakers,
+                "open": sorted(
+                    target
+                    for target, breaker in self.breakers.items()
+                    if breaker.is_open
+                ),
+            },
+        )
+
+    @journaled
+    @profiled
+    async def motion_event(
+        self, event: str, data: dict[str, Any], _: dict[str, Any]
+    ) -> None:
+        """Main handler for motion events."""
+
+        # low latency: switch on from cached state before anything else
+        if event == "state_changed_detection":
+            fast = bool(data.get("fast"))
+        else:
+            fast = self.low_latency and self.fast_on()
+
+        self.lg(
+            f"{stack()[0][3]}: received '{hl(event)}' event from "
+            f"'{data['entity_id'].replace(EntityType.MOTION.prefix, '')}' | {self.dimming = }",
+            level=logging.DEBUG,
+        )
+
+        # check if automoli is disabled via home assistant entity
+        self.lg(
+            f"{stack()[0][3]}: {await self.is_disabled() = } | {self.dimming = }",
+            level=logging.DEBUG,
+        )
+        if event != "state_changed_detection":
+            self.sensor_seen(data["entity_id"], self.states["motion_on"])
+
+        if await self.is_disabled():
+            return
+
+        self.gate("dimming", self.dimming)
+        self.learn_gap()
+        if self.shadow is None:
+            TRANSITIONS.motion(self.room_name, monotonic())
+
+        # motion behind closed doors → room stays occupied until a door opens
+        if self.room.door_window and not self.doors_open and not self.sealed:
+            self.lg(
+                f"{stack()[0][3]}: motion with all doors/windows closed → room sealed",
+                level=logging.DEBUG,
+            )
+            self.sealed = True
+            self.save_state()
+
+        self.gate("sealed", self.sealed)
+
+        if self.provisional:
+            self.lg(
+                f"{stack()[0][3]}: provisional lights confirmed by motion",
+                level=logging.DEBUG,
+            )
+            self.provisional = False
+
+        # fast path commands failed or skipped → switch on the regular way
+        if fast and FAILED in await asyncio.gather(*self._fast_calls):
+            self.act("fast_failed")
+            fast = False
+
+        if fast:
+            self.act("fast_on")
+            self.record_switch("on")
+            self.lg(
+                f"{hl(self.room.name.capitalize())} turned {hl('on')} → fast path"
+                f" | delay: {hl(natural_time(self.current_delay()))}",
+                icon=ON_ICON,
+            )
+
+        # re-triggered right after switching off → just restore the previous state
+        elif self.flap and self.flap.in_grace(monotonic()):
+            self.lg(
+                f"{stack()[0][3]}: restoring within grace period | {self.flap.stats = }",
+                level=logging.DEBUG,
+            )
+            await self.restore_lights()
+
+        # turn on the lights if not already
+        elif self.dimming or not self.gate(
+            "lights_on",
+            any([await self.read_state(light) == "on" for light in self.lights]),
+        ):
+            self.lg(
+                f"{stack()[0][3]}: switching on | {self.dimming = }",
+                level=logging.DEBUG,
+            )
+            await self.lights_on()
+        else:
+            self.act("refresh")
+            self.lg(
+                f"{stack()[0][3]}: light in {self.room.name.capitalize()} already on → refreshing "
+                f"timer | {self.dimming = }",
+                level=logging.DEBUG,
+            )
+
+        if event != "state_changed_detection":
+            await self.refresh_timer()
+
+        if self.prelight:
+            self.prelight_next_rooms()
+
+    async def cache_state(
+        self, entity: str, attribute: str, old: str, new: str, _: dict[str, Any]
+    ) -> None:
+        self._cache[entity] = new
+
+    def entities_changed(self, event: dict[str, Any]) -> None:
+        """keep the cached states current from `subscribe_entities` events"""
+
+        for entity, state in (event.get("a") or {}).items():
+            self._cache[entity] = state.get("s")
+        for entity, diff in (event.get("c") or {}).items():
+            if "s" in (added := diff.get("+") or {}):
+                self._cache[entity] = added["s"]
+        for entity in event.get("r") or []:
+            self._cache.pop(entity, None)
+
+    async def connect_websocket(self, entity_ids: Iterable[str]) -> None:
+        """connect & subscribe to the cached entities, released if this fails"""
+
+        websocket: HAWebsocket = self.websocket  # type: ignore[assignment]
+        try:
+            await asyncio.wait_for(websocket.connect(), WEBSOCKET_CONNECT_TIMEOUT_SEC)
+            if entity_ids:
+                await asyncio.wait_for(
+                    websocket.subscribe_entities(entity_ids, self.entities_changed),
+                    WEBSOCKET_CONNECT_TIMEOUT_SEC,
+                )
+            return
+        except asyncio.TimeoutError:
+            error: Any = f"no response within {WEBSOCKET_CONNECT_TIMEOUT_SEC}s"
+        except (aiohttp.ClientError, ConnectionError, OSError) as exception:
+            error = exception
+
+        self.lg(
+            f"websocket {websocket.url} is unavailable: {error} → using appdaemon",
+            level=logging.WARNING,
+        )
+        await self.release_websocket()
+
+    async def release_websocket(self) -> None:
+        """stop using the websocket, closed with its last user"""
+
+        websocket: HAWebsocket = self.websocket  # type: ignore[assignment]
+        self.websocket = None
+        websocket.users -= 1
+        await websocket.unsubscribe(self.entities_changed)
+        if not websocket.users:
+            WEBSOCKETS.pop(websocket.url, None)
+            await websocket.close()
+
+    def fast_on(self) -> bool:
+        """switch the lights on from cached state & precomputed calls.
+
+        Runs before the first await of a motion handler, the regular checks and
+        bookkeeping follow after the commands have been sent.
+        """
+
+        cache, now = self._cache, monotonic()
+        if (
+            self.dimming
+            or (self.flap and self.flap.in_grace(now))
+            or any(cache.get(light) == "on" for light in self.lights)
+            or any(self.manually_controlled(light) for light in self.lights)
+            or any(
+                not breaker.allow(now)
+                for light in self.lights
+                if (breaker := self.breakers.get(light))
+            )
+            or any(
+                cache.get(entity) in self.disable_switch_states
+                for entity in self.disable_switch_entities
+            )
+        ):
+            return False
+
+        if threshold := self.thresholds.get(EntityType.ILLUMINANCE.idx):
+            try:
+                if any(
+                    float(cache.get(sensor)) >= threshold  # type:ignore
+                    for sensor in self.sensors[EntityType.ILLUMINANCE.idx]
+                ):
+                    return False
+            except (TypeError, ValueError):
+                return False
+
+        night = bool(self.night_mode) and cache.get(self.night_mode["entity"]) == "on"
+        light_setting = (
+            self.night_mode.get("light") if night else self.active.get("light_setting")
+        )
+        if scene := self.staged.get(self.stage_name(night)):
+            plan = [("scene/turn_on", {"entity_id": scene})]
+        else:
+            if light_setting not in self._plans:
+                self._plans[light_setting] = self.turn_on_plan(light_setting)
+            if not (plan := self._plans[light_setting]):
+                return False
+
+        # awaited by the motion handler, falling back to the regular path on failure
+        self._fast_calls = [
+            asyncio.ensure_future(self.service_call(service, **data))
+            for service, data in plan
+        ]
+
+        if self.only_own_events:
+            if str(light_setting).startswith("scene."):
+                self._switched_on_by_automoli.add(str(light_setting))
+            else:
+                self._switched_on_by_automoli.update(self.lights)
+
+        return True
+
+    def stage_name(self, night: bool) -> str:
+        return "night" if night else str(self.active.get("daytime"))
+
+    async def stage_scenes(self, names: Iterable[str] | None = None) -> None:
+        """create a home assistant scene for every brightness daytime & night mode"""
+
+        settings = dict(self.daytime_settings)
+        if self.night_mode:
+            settings["night"] = self.night_mode.get("light")
+
+        staged: dict[str, str] = {}
+        calls = []
+        for name, light_setting in settings.items():
+            if names is not None and name not in names:
+                continue
+            if not isinstance(light_setting, int) or light_setting <= 0:
+                continue
+
+            scene_id = re.sub(r"\W+", "_", f"automoli_{self.room_name}_{name}".lower())
+            staged[name] = f"scene.{scene_id}"
+            calls.append(
+                self.service_call(
+                    "scene/create",
+                    scene_id=scene_id,
+                    entities={
+                        light: {
+                            "state": "on",
+                            "brightness": round(light_setting * 255 / 100),
+                        }
+                        if self.entity_meta[light].dimmable
+                        else "on"
+                        for light in self.lights
+                    },
+                )
+            )
+
+        for (name, scene), result in zip(staged.items(), await asyncio.gather(*calls)):
+            if result is not None or self.shadow is not None:
+                self.staged[name] = scene
+            else:
+                self.staged.pop(name, None)
+
+        self.lg(f"{stack()[0][3]}: {self.staged = }", level=logging.DEBUG)
+
+    async def restage_scenes(
+        self, event: str, data: dict[str, Any], _: dict[str, Any]
+    ) -> None:
+        await self.stage_scenes()
+
+    def turn_on_plan(
+        self, light_setting: Any
+    ) -> list[tuple[str, dict[str, Any]]] | None:
+        """service calls switching on the lights with a light setting, batched
+        where possible. `None` for settings only `lights_on` handles."""
+
+        if isinstance(light_setting, str) and light_setting.startswith("scene."):
+            return [("homeassistant/turn_on", {"entity_id": light_setting})]
+
+        if isinstance(light_setting, str) and light_setting != CIRCADIAN:
+            return [
+                (
+                    "hue/hue_activate_scene",
+                    {
+                        "group_name": self.entity_meta[entity].friendly_name,
+                        "scene_name": light_setting,
+                    },
+                )
+                if self.active["is_hue_group"] and self.entity_meta[entity].is_hue_group
+                else ("homeassistant/turn_on", {"entity_id": entity})
+                for entity in self.lights
+            ]
+
+        if isinstance(light_setting, int) and light_setting > 0:
+            switches = [light for light in self.lights if light.startswith("switch.")]
+            lights = [light for light in self.lights if light not in switches]
+            plan: list[tuple[str, dict[str, Any]]] = []
+            if switches:
+                plan.append(("homeassistant/turn_on", {"entity_id": switches}))
+            if lights:
+                plan.append(
+                    (
+                        "homeassistant/turn_on",
+                        {"entity_id": lights, "brightness_pct": light_setting},
+                    )
+                )
+            return plan
+
+        return None
+
+    @journaled
+    async def zone_motion(
+        self, entity: str, attribute: str, old: str, new: str, _: dict[str, Any]
+    ) -> None:
+        """motion/no motion of a zone sensor with on/off states"""
+
+        zone = self.zone_of[entity]
+        self.sensor_seen(entity, new)
+
+        if new == self.states["motion_on"]:
+            await self.zone_on(zone)
+
+        elif new == self.states["motion_off"] and all(
+            [
+                await self.read_state(sensor) == self.states["motion_off"]
+                for sensor in zone.motion
+            ]
+        ):
+            await self.zone_timer(zone)
+
+    @journaled
+    async def zone_event(
+        self, event: str, data: dict[str, Any], _: dict[str, Any]
+    ) -> None:
+        """motion event of a zone sensor"""
+
+        zone = self.zone_of[data["entity_id"]]
+        self.sensor_seen(data["entity_id"], self.states["motion_on"])
+
+        await self.zone_on(zone)
+        await self.zone_timer(zone)
+
+    async def zone_on(self, zone: Zone) -> None:
+        """switch on the lights of a zone, gated like the room"""
+
+        self.gate("zone", zone.name)
+        if await self.is_disabled():
+            return
+
+        await self.cancel_zone_timer(zone)
+
+        if self.gate(
+            "lights_on",
+            any([await self.read_state(light) == "on" for light in zone.lights]),
+        ):
+            self.act("refresh")
+            return
+
+        await self.lights_on(zone=zone)
+
+    async def zone_timer(self, zone: Zone) -> None:
+        """(re)start the off timer of a zone"""
+
+        await self.cancel_zone_timer(zone)
+
+        if delay := (zone.delay if zone.delay is not None else self.current_delay()):
+            zone.handle = await self.run_in(self.zone_off, delay, zone=zone.name)
+            self.act(f"timer:{zone.name}:{delay}")
+
+    async def cancel_zone_timer(self, zone: Zone) -> None:
+        if zone.handle and await self.timer_running(zone.handle):
+            await self.cancel_timer(zone.handle)
+        zone.handle = None
+
+    @journaled
+    async def zone_off(self, kwargs: dict[str, Any]) -> None:
+        """switch off the lights of a zone"""
+
+        zone = self.zones[kwargs["zone"]]
+        await self.cancel_zone_timer(zone)
+
+        if await self.is_disabled():
+            return
+
+        # blockers keep the zone on, checked again after its delay
+        if await self.is_blocked(refresh=False):
+            await self.zone_timer(zone)
+            return
+
+        turned_off = {
+            light
+            for light in zone.lights
+            if not self.manually_controlled(light)
+            and (not self.only_own_events or light in self._switched_on_by_automoli)
+        }
+        self._switched_on_by_automoli -= turned_off
+
+        await asyncio.gather(
+            *[
+                self.service_call("homeassistant/turn_off", entity_id=light)
+                for light in turned_off
+            ]
+        )
+
+        if turned_off:
+            self.act(f"off:{zone.name}")
+            self.notifications.notify(
+                f"turned_off:{zone.name}",
+                f"no motion in {hl(f'{self.room.name.capitalize()} {zone.name}')} "
+                f"since {hl(natural_time(zone.delay or self.current_delay()))} → "
+                f"turned {hl('off')}",
+                icon=OFF_ICON,
+            )
+
+    def prelight_next_rooms(self) -> None:
+        """provisionally switch on the lights in the most likely next room(s)"""
+
+        # a shadow instance must not switch the live rooms
+        if self.shadow is not None:
+            return
+
+        rooms: list[str] | None = None
+        if self.prelight["learn"]:
+            rooms = TRANSITIONS.likely(
+                self.room_name,
+                self.prelight["rooms"],
+                self.prelight["probability"],
+                self.prelight["max_rooms"],
+            )
+        if rooms is None:
+            rooms = self.prelight["rooms"]
+
+        for room_name in rooms:
+            if (room := ROOMS.get(room_name)) and room is not self:
+                self.background(room.prelit(self.room_name, self.prelight["delay"]))
+
+    @journaled
+    async def prelit(self, source: str, delay: int) -> None:
+        """switch on the lights with a short delay, expecting motion from `source`"""
+
+        if (
+            self.dimming
+            or await self.is_disabled()
+            or any([await self.read_state(light) == "on" for light in self.lights])
+        ):
+            return
+
+        await self.lights_on()
+
+        await self.clear_handles()
+        self.provisional = True
+        self.room.handles_automoli.add(await self.run_in(self.lights_off, delay))
+        self.act(f"prelight:{source}")
+
+        self.lg(
+            f"{hl(self.room.name.capitalize())} pre-lit for motion in "
+            f"{hl(source.capitalize())} | off in {hl(natural_time(delay))} "
+            f"without motion",
+            level=logging.DEBUG,
+        )
+
+    def background(self, coroutine: Coroutine[Any, Any, Any]) -> None:
+        """run a coroutine without waiting for it, outside of the current decision"""
+        task = asyncio.ensure_future(detached(coroutine))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def learn_gap(self) -> None:
+        """add the time since the last motion to the active daytimes histogram"""
+
+        now = monotonic()
+        last_motion, self._last_motion = self._last_motion, now
+
+        if not self.adaptive_delay or last_motion is None:
+            return
+
+        # longer gaps mean the room was empty
+        if (gap := now - last_motion) > self.adaptive_delay["max"]:
+            return
+
+        daytime = str(self.active.get("daytime"))
+        self.gaps.setdefault(daytime, GapHistogram()).add(gap)
+        self.gaps_file.schedule()
 
-        # add night mode to config if enabled
-        if self.night_mode:
-            self.args.update({"night_mode": self.night_mode})
+    def current_delay(self) -> int:
+        """off delay of the active daytime, learned from the motion gaps if enabled"""
 
-        # add disable entity to config if given
-        if self.disable_switch_entities:
-            self.args.update({"disable_switch_entities": self.disable_switch_entities})
-            self.args.update({"disable_switch_states": self.disable_switch_states})
+        delay = int(self.active.get("delay", 0))
 
-        # show parsed config
-        self.show_info(self.args)
+        # lights are never switched off
+        if not delay:
+            return delay
 
-        await asyncio.gather(*listener)
-        await self.refresh_timer()
+        if self.adaptive_delay and (
+            (gaps := self.gaps.get(str(self.active.get("daytime"))))
+            and gaps.total >= GAP_MIN_SAMPLES
+        ):
+            learned = gaps.quantile(float(self.adaptive_delay["quantile"]))
+            delay = int(
+                min(
+                    max(learned, self.adaptive_delay["min"]),
+                    self.adaptive_delay["max"],
+                )
+            )
 
-    async def switch_daytime(self, kwargs: dict[str, Any]) -> None:
-        """Set new light settings according to daytime."""
+        # give flapping rooms more time
+        if self.flap and self.flap.flapping(monotonic()):
+            delay = int(delay * self.flap.factor)
 
-        daytime = kwargs.get("daytime")
+        return delay
 
-        if daytime is not None:
-            self.active = daytime
-            if not kwargs.get("initial"):
+    def record_switch(self, state: str, lights: Iterable[str] = ()) -> None:
+        """track on/off transitions to detect flapping"""
 
-                delay = daytime["delay"]
-                light_setting = daytime["light_setting"]
-                if isinstance(light_setting, str):
-                    is_scene = True
-                    # if its a ha scene, remove the "scene." part
-                    if "." in light_setting:
-                        light_setting = (light_setting.split("."))[1]
-                else:
-                    is_scene = False
+        if not self.flap:
+            return
 
-                self.lg(
-                    f"{stack()[0][3]}: {self.transition_on_daytime_switch = }",
-                    level=logging.DEBUG,
-                )
+        now = monotonic()
+        was_flapping = self.flap.flapping(now)
 
-                action_done = "set"
+        if state == "off":
+            self.flap.lights_off = set(lights)
 
-                if self.transition_on_daytime_switch and any(
-                    [await self.get_state(light) == "on" for light in self.lights]
-                ):
-                    await self.lights_on(force=True)
-                    action_done = "activated"
+        flap = self.flap.switched(state, now)
 
-                self.lg(
-                    f"{action_done} daytime {hl(daytime['daytime'])} → "
-                    f"{'scene' if is_scene else 'brightness'}: {hl(light_setting)}"
-                    f"{'' if is_scene else '%'}, delay: {hl(natural_time(delay))}",
-                    icon=DAYTIME_SWITCH_ICON,
+        if flap and not was_flapping and self.flap.flapping(now):
+            self.lg(
+                f"{hl(self.room.name.capitalize())} is flapping → extending "
+                f"delay to {hl(natural_time(self.current_delay()))} | {self.flap.stats}"
+            )
+
+    @journaled
+    async def restore_lights(self) -> None:
+        """switch the lights switched off last back on, without re-evaluating"""
+
+        if not self.flap:
+            return
+
+        lights, self.flap.lights_off = self.flap.lights_off, set()
+
+        await asyncio.gather(
+            *[
+                self.service_call(
+                    "homeassistant/turn_on", entity_id=entity  # type:ignore
                 )
+                for entity in lights
+            ]
+        )
+        if self.only_own_events:
+            self._switched_on_by_automoli.update(lights)
 
-    async def motion_cleared(
-        self, entity: str, attribute: str, old: str, new: str, _: dict[str, Any]
-    ) -> None:
-        """wrapper for motion sensors that do not push a certain event but.
-        instead the default HA `state_changed` event is used for presence detection
-        schedules the callback to switch the lights off after a `state_changed` callback
-        of a motion sensors changing to "cleared" is received
-        """
+        self.record_switch("on")
+        self.flap.stats["restored"] += 1
+        self.act("restore")
 
-        # starte the timer if motion is cleared
         self.lg(
-            f"{stack()[0][3]}: {entity} changed {attribute} from {old} to {new}",
-            level=logging.DEBUG,
+            f"{hl(self.room.name.capitalize())} turned {hl('on')} again → "
+            f"restored previous state | {self.flap.stats}",
+            icon=ON_ICON,
         )
 
-        if all(
-            [
-                await self.get_state(sensor) == self.states["motion_off"]
-                for sensor in self.sensors[EntityType.MOTION.idx]
-            ]
-        ):
-            # all motion sensors off, starting timer
-            await self.refresh_timer()
-        else:
-            # cancel scheduled callbacks
-            await self.clear_handles()
+    def collect_gaps(self) -> dict[str, Any]:
+        return {
+            "version": 1,
+            "gaps": {daytime: list(gaps.counts) for daytime, gaps in self.gaps.items()},
+        }
 
-    async def motion_detected(
-        self, entity: str, attribute: str, old: str, new: str, kwargs: dict[str, Any]
-    ) -> None:
-        """wrapper for motion sensors that do not push a certain event but.
-        instead the default HA `state_changed` event is used for presence detection
-        maps the `state_changed` callback of a motion sensors changing to "detected"
-        to the `event` callback`
-        """
+    def save_state(self) -> None:
+        """write the runtime snapshot soon (coalesced)"""
+        if self.persist_state:
+            self.runtime_file.schedule()
+
+    def collect_runtime_state(self) -> dict[str, Any]:
+        now, now_ts = monotonic(), datetime.now().timestamp()
+        return {
+            "version": 1,
+            "daytime": self.active.get("daytime"),
+            "switched_on": sorted(self._switched_on_by_automoli),
+            "dimming": self.dimming,
+            "sealed": self.sealed,
+            "off_deadline": self._off_deadline,
+            "manual": {
+                entity: now_ts + until - now
+                for entity, until in self._manual_until.items()
+                if until > now
+            },
+        }
+
+    async def restore_state(self) -> bool:
+        """resume from the last runtime snapshot, returns if a timer was resumed"""
+
+        if not self.persist_state or not (snapshot := await self.runtime_file.load()):
+            return False
+
+        now, now_ts = monotonic(), datetime.now().timestamp()
+
+        self._switched_on_by_automoli.update(snapshot.get("switched_on", []))
+        # a door opened while AppDaemon was down unseals the room
+        self.sealed = bool(
+            self.room.door_window and not self.doors_open and snapshot.get("sealed")
+        )
+        self._manual_until.update(
+            {
+                entity: now + until - now_ts
+                for entity, until in snapshot.get("manual", {}).items()
+                if until > now_ts
+            }
+        )
 
         self.lg(
-            f"{stack()[0][3]}: {entity} changed {attribute} from {old} to {new}",
+            f"{stack()[0][3]}: {snapshot = } | active daytime: {self.active.get('daytime')}",
             level=logging.DEBUG,
         )
 
-        # cancel scheduled callbacks
-        await self.clear_handles()
+        if self.sealed or (deadline := snapshot.get("off_deadline")) is None:
+            return False
+
+        self.dimming = bool(snapshot.get("dimming"))
+        remaining = max(int(deadline - now_ts), 1)
+        await self.schedule_off(remaining)
 
         self.lg(
-            f"{stack()[0][3]}: handles cleared and cancelled all scheduled timers"
-            f" | {self.dimming = }",
+            f"{hl(self.room.name.capitalize())} resumed → off in "
+            f"{hl(natural_time(remaining))}",
             level=logging.DEBUG,
         )
 
-        # calling motion event handler
-        data: dict[str, Any] = {"entity_id": entity, "new": new, "old": old}
-        await self.motion_event("state_changed_detection", data, kwargs)
+        return True
 
-    async def motion_event(
-        self, event: str, data: dict[str, str], _: dict[str, Any]
+    def gate(self, name: str, value: Any) -> Any:
+        """record a checked condition in the current decision and return it"""
+        if (record := DECISION.get()) is not None:
+            record["gates"][name] = value
+        return value
+
+    def act(self, action: str) -> None:
+        """record an action taken in the current decision"""
+        if (record := DECISION.get()) is not None:
+            record["actions"].append(action)
+
+    async def journal_endpoint(
+        self, data: dict[str, Any] | None = None, kwargs: dict[str, Any] | None = None
+    ) -> tuple[dict[str, Any], int]:
+        """return the last decisions, optionally limited by `limit`
+
+        With `profiling` enabled, `profile` starts profiling for that many seconds.
+        """
+
+        records = list(self.journal)
+        if isinstance(data, dict) and (limit := int(data.get("limit", 0))):
+            records = records[-limit:]
+
+        if isinstance(data, dict) and self.profiling and data.get("profile"):
+            await self.start_profiling(float(data["profile"]))
+
+        return {
+            "room": self.room_name,
+            "active_daytime": self.active.get("daytime"),
+            "delay": self.current_delay(),
+            "open_breakers": self.open_breakers,
+            "latency_ms": self.latency_stats,
+            "profiling": self.profiler is not None,
+            "journal": records,
+            **({"shadow": list(self.shadow)} if self.shadow is not None else {}),
+        }, 200
+
+    async def profile_requested(
+        self, _: str, data: dict[str, Any], __: dict[str, Any]
     ) -> None:
-        """Main handler for motion events."""
+        """profile this room if requested for it or for all rooms"""
+
+        if data.get("room", self.room_name) in (self.room_name, "all"):
+            await self.start_profiling(float(data.get("seconds", DEFAULT_PROFILE_SEC)))
+
+    async def start_profiling(self, seconds: float) -> None:
+        if self.profiler is not None:
+            self.lg(f"{hl(self.room_name)} is already being profiled")
+            return
+
+        self.profiler = Profiler(seconds)
+        await self.run_in(self.stop_profiling, seconds)
+        self.lg(f"profiling {hl(self.room_name)} for {natural_time(int(seconds))}")
+
+    async def stop_profiling(self, _: Any = None) -> None:
+        """write the collected profile to the storage directory"""
+
+        if (profiler := self.profiler) is None:
+            return
+        self.profiler = None
 
+        loop = asyncio.get_running_loop()
+        files = await loop.run_in_executor(
+            None, profiler.write, self.storage / PROFILE_DIR, self.name
+        )
         self.lg(
-            f"{stack()[0][3]}: received '{hl(event)}' event from "
-            f"'{data['entity_id'].replace(EntityType.MOTION.prefix, '')}' | {self.dimming = }",
-            level=logging.DEBUG,
+            f"profile of {hl(self.room_name)} ({sum(profiler.calls.values())} "
+            f"handler calls) written to {hl(str(files[0].parent))}"
         )
 
-        # check if automoli is disabled via home assistant entity
-        self.lg(
-            f"{stack()[0][3]}: {await self.is_disabled() = } | {self.dimming = }",
-            level=logging.DEBUG,
+    def call_service(self, service: str, **data: Any) -> Any:
+        """call a home assistant service, recorded only in shadow mode"""
+        if getattr(self, "shadow", None) is None:
+            return super().call_service(service, **data)
+        return self.record_command("call_service", service, data)
+
+    def set_state(self, entity_id: str, **kwargs: Any) -> Any:
+        """set an entity state, recorded only in shadow mode"""
+        if getattr(self, "shadow", None) is None:
+            return super().set_state(entity_id, **kwargs)
+        return self.record_command("set_state", entity_id, kwargs)
+
+    def record_command(
+        self, command: str, target: str, data: dict[str, Any]
+    ) -> asyncio.Future[None]:
+        """record a command that would have been sent, attributed to the decision"""
+
+        decision = DECISION.get()
+        self.shadow.append(  # type: ignore[union-attr]
+            {
+                "ts": datetime.now().timestamp(),
+                "handler": decision["handler"] if decision else None,
+                "command": command,
+                "target": target,
+                "data": data,
+            }
         )
-        if await self.is_disabled():
-            return
+        self.act(f"shadow:{target}")
 
-        # turn on the lights if not already
-        if self.dimming or not any(
-            [await self.get_state(light) == "on" for light in self.lights]
-        ):
-            self.lg(
-                f"{stack()[0][3]}: switching on | {self.dimming = }",
-                level=logging.DEBUG,
-            )
-            await self.lights_on()
-        else:
-            self.lg(
-                f"{stack()[0][3]}: light in {self.room.name.capitalize()} already on → refreshing "
-                f"timer | {self.dimming = }",
-                level=logging.DEBUG,
-            )
+        # awaitable like the real calls, also fire-and-forget as in `lg`
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+        return future
 
-        if event != "state_changed_detection":
-            await self.refresh_timer()
+    async def terminate(self) -> None:
+        """write pending state to disk & release the websocket connection"""
+
+        if ROOMS.get(getattr(self, "room_name", "")) is self:
+            del ROOMS[self.room_name]
+
+        if getattr(self, "profiler", None) is not None:
+            await self.stop_profiling()
+
+        if shard := getattr(self, "shard", None):
+            shard.users -= 1
+            shard.withdraw(self.room_name)
+            if not shard.users:
+                SHARDS.pop(shard.directory, None)
+                await shard.state_file.flush()
+
+        if getattr(self, "websocket", None):
+            await self.release_websocket()
+
+        # the on-time since the last accounting
+        if getattr(self, "energy", None):
+            self.account_lights()
+
+        for state_file in getattr(self, "state_files", []):
+            await state_file.flush()
+
+        if event_log := getattr(self, "event_log", None):
+            await event_log.flush()
 
     def has_min_ad_version(self, required_version: str) -> bool:
         required_version = required_version if required_version else "4.0.7"
@@ -616,6 +3644,8 @@ class AutoMoLi(hass.Hass):  # type: ignore
         if not handles:
             handles = deepcopy(self.room.handles_automoli)
             self.room.handles_automoli.clear()
+            self._off_deadline = None
+            self.save_state()
 
         if self.has_min_ad_version("4.0.7"):
             await asyncio.gather(
@@ -630,6 +3660,7 @@ class AutoMoLi(hass.Hass):  # type: ignore
 
         self.lg(f"{stack()[0][3]}: cancelled scheduled callbacks", level=logging.DEBUG)
 
+    @profiled
     async def refresh_timer(self) -> None:
         """refresh delay timer."""
 
@@ -637,56 +3668,80 @@ class AutoMoLi(hass.Hass):  # type: ignore
 
         # leave dimming state
         self.dimming = False
-
-        dim_in_sec = 0
+        self.provisional = False
 
         # cancel scheduled callbacks
         await self.clear_handles()
 
+        # someone is in the room, the off timer starts when a door/window opens
+        if self.sealed:
+            self.lg(f"{fnn} room sealed → timer suspended", level=logging.DEBUG)
+            self.act("suspend")
+            return
+
         # if no delay is set or delay = 0, lights will not switched off by AutoMoLi
-        if delay := self.active.get("delay"):
+        if delay := self.current_delay():
 
             self.lg(
                 f"{fnn} {self.active = } | {delay = } | {self.dim = }",
                 level=logging.DEBUG,
             )
 
-            if self.dim:
-                dim_in_sec = int(delay) - self.dim["seconds_before"]
-                self.lg(f"{fnn} {dim_in_sec = }", level=logging.DEBUG)
-
-                handle = await self.run_in(self.dim_lights, (dim_in_sec))
-
-            else:
-                handle = await self.run_in(self.lights_off, delay)
+            handle = await self.schedule_off(delay)
+            self.act(f"timer:{delay}")
 
-            self.room.handles_automoli.add(handle)
+            if self.flap and self.flap.flapping(monotonic()):
+                self.flap.stats["extended"] += 1
 
             if timer_info := await self.info_timer(handle):
                 self.lg(
-                    f"{fnn} scheduled callback to switch off the lights in {dim_in_sec}s "
+                    f"{fnn} scheduled callback to switch off the lights in {delay}s "
                     f"({timer_info[0].isoformat()}) | "
                     f"handles: {self.room.handles_automoli = }",
                     level=logging.DEBUG,
                 )
 
+    async def schedule_off(self, delay: int) -> str:
+        """schedule dimming/switching off the lights in `delay` seconds"""
+
+        if self.dim and (dim_in_sec := delay - int(self.dim["seconds_before"])) > 0:
+            self.lg(f"{stack()[0][3]}: {dim_in_sec = }", level=logging.DEBUG)
+            handle = await self.run_in(self.dim_lights, dim_in_sec)
+        else:
+            handle = await self.run_in(self.lights_off, delay)
+
+        self.room.handles_automoli.add(handle)
+        self._off_deadline = datetime.now().timestamp() + delay
+        self.save_state()
+
+        return str(handle)
+
     async def night_mode_active(self) -> bool:
         return bool(
-            self.night_mode and await self.get_state(self.night_mode["entity"]) == "on"
+            self.night_mode and await self.read_state(self.night_mode["entity"]) == "on"
+        )
+
+    async def read_state(
+        self, entity_id: str | None = None, attribute: str | None = None
+    ) -> Any:
+        """read appdaemon's state without copying, dicts are read-only views"""
+        return read_only(
+            await self.get_state(entity_id, attribute=attribute, copy=False)
         )
 
     async def is_disabled(self) -> bool:
         """check if automoli is disabled via home assistant entity"""
         for entity in self.disable_switch_entities:
             if (
-                state := await self.get_state(entity, copy=False)
+                state := await self.read_state(entity)
             ) and state in self.disable_switch_states:
                 self.lg(f"{APP_NAME} is disabled by {entity} with {state = }")
-                return True
+                return self.gate("disabled", True)
 
-        return False
+        return self.gate("disabled", False)
 
-    async def is_blocked(self) -> bool:
+    async def is_blocked(self, refresh: bool = True) -> bool:
+        """check the blockers, `refresh` restarts the room timer while blocked"""
 
         # the "shower case"
         if humidity_threshold := self.thresholds.get("humidity"):
@@ -694,11 +3749,11 @@ class AutoMoLi(hass.Hass):  # type: ignore
             for sensor in self.sensors[EntityType.HUMIDITY.idx]:
                 try:
                     current_humidity = float(
-                        await self.get_state(sensor)  # type:ignore
+                        await self.read_state(sensor)  # type:ignore
                     )
                 except ValueError as error:
                     self.lg(
-                        f"self.get_state(sensor) raised a ValueError for {sensor}: {error}",
+                        f"self.read_state(sensor) raised a ValueError for {sensor}: {error}",
                         level=logging.ERROR,
                     )
                     continue
@@ -711,17 +3766,66 @@ class AutoMoLi(hass.Hass):  # type: ignore
 
                 if current_humidity >= humidity_threshold:
 
-                    await self.refresh_timer()
+                    if refresh:
+                        await self.refresh_timer()
                     self.lg(
                         f"🛁 no motion in {hl(self.room.name.capitalize())} since "
-                        f"{hl(natural_time(int(self.active['delay'])))} → "
+                        f"{hl(natural_time(self.current_delay()))} → "
                         f"but {hl(current_humidity)}%RH > "
                         f"{hl(humidity_threshold)}%RH"
                     )
-                    return True
+                    return self.gate("blocked", True)
 
-        return False
+        # the "shower case", relative to the rolling baseline
+        for sensor, trend in self.humidity_trends.items():
 
+            self.lg(
+                f"{stack()[0][3]}: {sensor} | {trend.current = } | {trend.baseline = } "
+                f"| {trend.rate = } | {trend.rising = }",
+                level=logging.DEBUG,
+            )
+
+            if trend.check(monotonic()):
+
+                if refresh:
+                    await self.refresh_timer()
+                self.lg(
+                    f"🛁 no motion in {hl(self.room.name.capitalize())} since "
+                    f"{hl(natural_time(self.current_delay()))} → "
+                    f"but {hl(trend.current)}%RH is {hl(round(trend.delta, 1))}%RH "
+                    f"above the baseline ({hl(round(trend.rate, 2))}%RH/min)"
+                )
+                return self.gate("blocked", True)
+
+        return self.gate("blocked", False)
+
+    async def humidity_changed(
+        self, entity: str, attribute: str, old: str, new: str, _: dict[str, Any]
+    ) -> None:
+        """feed the trend detector of a humidity sensor with a new sample."""
+
+        try:
+            humidity = float(new)
+        except (TypeError, ValueError):
+            self.lg(
+                f"{stack()[0][3]}: ignoring invalid humidity '{new}' from {entity}",
+                level=logging.DEBUG,
+            )
+            return
+
+        if not (trend := self.humidity_trends.get(entity)):
+            return
+
+        was_rising = trend.rising
+        if trend.add(humidity, monotonic()) != was_rising:
+            self.lg(
+                f"{stack()[0][3]}: {entity} {'rising' if trend.rising else 'settled'}"
+                f" | {humidity}%RH | baseline: {trend.baseline} | {trend.rate = }",
+                level=logging.DEBUG,
+            )
+
+    @journaled
+    @profiled
     async def dim_lights(self, _: Any) -> None:
 
         message: str = ""
@@ -735,7 +3839,7 @@ class AutoMoLi(hass.Hass):  # type: ignore
         if (await self.is_disabled()) or (await self.is_blocked()):
             return
 
-        if not any([await self.get_state(light) == "on" for light in self.lights]):
+        if not any([await self.read_state(light) == "on" for light in self.lights]):
             return
 
         dim_method: DimMethod
@@ -773,6 +3877,7 @@ class AutoMoLi(hass.Hass):  # type: ignore
                 )
 
             self.dimming = True
+            self.act(f"dim:{dim_method.name.lower()}")
 
             self.lg(
                 f"{stack()[0][3]}: {dim_attributes = } | {self.dimming = }",
@@ -780,22 +3885,31 @@ class AutoMoLi(hass.Hass):  # type: ignore
             )
 
             self.lg(f"{stack()[0][3]}: {self.room.room_lights = }", level=logging.DEBUG)
+            self.lg(f"{stack()[0][3]}: {self.lights_dimmable = }", level=logging.DEBUG)
             self.lg(
-                f"{stack()[0][3]}: {self.room.lights_dimmable = }", level=logging.DEBUG
-            )
-            self.lg(
-                f"{stack()[0][3]}: {self.room.lights_undimmable = }",
-                level=logging.DEBUG,
+                f"{stack()[0][3]}: {self.lights_undimmable = }", level=logging.DEBUG
             )
 
-            if self.room.lights_undimmable:
-                for light in self.room.lights_dimmable:
+            if self.lights_undimmable:
+                lights = [
+                    light
+                    for light in self.lights_dimmable
+                    if not self.manually_controlled(light)
+                ]
 
-                    await self.call_service(
-                        "light/turn_off",
-                        entity_id=light,  # type:ignore
-                        **dim_attributes,  # type:ignore
-                    )
+                # stepping down the brightness is not idempotent
+                await asyncio.gather(
+                    *[
+                        self.service_call(
+                            "light/turn_off",
+                            idempotent=dim_method != DimMethod.STEP,
+                            entity_id=light,  # type:ignore
+                            **dim_attributes,  # type:ignore
+                        )
+                        for light in lights
+                    ]
+                )
+                for light in lights:
                     await self.set_state(entity_id=light, state="off")
 
         # workaround to switch off lights that do not support dimming
@@ -810,15 +3924,27 @@ class AutoMoLi(hass.Hass):  # type: ignore
 
         self.lg(message, icon=OFF_ICON, level=logging.DEBUG)
 
+    @journaled
     async def turn_off_lights(self, kwargs: dict[str, Any]) -> None:
         if lights := kwargs.get("lights"):
             self.lg(f"{stack()[0][3]}: {lights = }", level=logging.DEBUG)
-            for light in lights:
-                await self.call_service("homeassistant/turn_off", entity_id=light)
-            self.run_in_thread(self.turned_off, thread=self.notify_thread)
+            await asyncio.gather(
+                *[
+                    self.service_call("homeassistant/turn_off", entity_id=light)
+                    for light in lights
+                    if not self.manually_controlled(light)
+                ]
+            )
+            self.record_switch("off", lights)
+            self.act("off")
+            self.turned_off()
+
+    @profiled
+    async def lights_on(self, force: bool = False, zone: Zone | None = None) -> None:
+        """Turn on the lights (of a zone)."""
 
-    async def lights_on(self, force: bool = False) -> None:
-        """Turn on the lights."""
+        lights = zone.lights if zone else self.lights
+        where = f"{self.room.name.capitalize()}{f' {zone.name}' if zone else ''}"
 
         self.lg(
             f"{stack()[0][3]}: {self.thresholds.get(EntityType.ILLUMINANCE.idx) = }"
@@ -834,15 +3960,15 @@ class AutoMoLi(hass.Hass):  # type: ignore
             for sensor in self.sensors[EntityType.ILLUMINANCE.idx]:
                 self.lg(
                     f"{stack()[0][3]}: {self.thresholds.get(EntityType.ILLUMINANCE.idx) = } | "
-                    f"{float(await self.get_state(sensor)) = }",  # type:ignore
+                    f"{float(await self.read_state(sensor)) = }",  # type:ignore
                     level=logging.DEBUG,
                 )
                 try:
-                    if (
-                        illuminance := float(
-                            await self.get_state(sensor)  # type:ignore
-                        )  # type:ignore
-                    ) >= illuminance_threshold:
+                    illuminance = self.gate(
+                        sensor, float(await self.read_state(sensor))  # type:ignore
+                    )
+                    if illuminance >= illuminance_threshold:
+                        self.act("bright_enough")
                         self.lg(
                             f"According to {hl(sensor)} its already bright enough ¯\\_(ツ)_/¯"
                             f" | {illuminance} >= {illuminance_threshold}"
@@ -851,95 +3977,174 @@ class AutoMoLi(hass.Hass):  # type: ignore
 
                 except ValueError as error:
                     self.lg(
-                        f"could not parse illuminance '{await self.get_state(sensor)}' "
+                        f"could not parse illuminance '{await self.read_state(sensor)}' "
                         f"from '{sensor}': {error}"
                     )
                     return
 
+        night = self.gate("night_mode", await self.night_mode_active())
         light_setting = (
-            self.active.get("light_setting")
-            if not await self.night_mode_active()
-            else self.night_mode.get("light")
+            self.night_mode.get("light") if night else self.active.get("light_setting")
         )
 
-        if isinstance(light_setting, str):
+        if light_setting == CIRCADIAN:
 
             # last check until we switch the lights on... really!
             if not force and any(
-                [await self.get_state(light) == "on" for light in self.lights]
+                [await self.read_state(light) == "on" for light in lights]
             ):
                 self.lg("¯\\_(ツ)_/¯")
+                self.act("already_on")
                 return
 
-            for entity in self.lights:
+            lights = [
+                entity for entity in lights if not self.manually_controlled(entity)
+            ]
+            values = await self.circadian_values()
+            await asyncio.gather(*self.circadian_calls(lights, values))
+            if self.only_own_events:
+                self._switched_on_by_automoli.update(lights)
 
-                if self.active["is_hue_group"] and await self.get_state(
-                    entity_id=entity, attribute="is_hue_group"
-                ):
-                    await self.call_service(
-                        "hue/hue_activate_scene",
-                        group_name=await self.friendly_name(entity),  # type:ignore
-                        scene_name=light_setting,  # type:ignore
-                    )
-                    if self.only_own_events:
-                        self._switched_on_by_automoli.add(entity)
-                    continue
+            self.lg(
+                f"{hl(where)} turned {hl('on')} → "
+                f"{CIRCADIAN}: "
+                f"{', '.join(f'{curve} {hl(value)}' for curve, value in values.items())}"
+                f" | delay: {hl(natural_time(self.current_delay()))}",
+                icon=ON_ICON,
+            )
+
+            # flapping is tracked for the room only
+            if not zone:
+                self.record_switch("on")
+            self.act(f"on:{CIRCADIAN}")
 
-                item = light_setting if light_setting.startswith("scene.") else entity
+        elif isinstance(light_setting, str):
 
-                await self.call_service(
-                    "homeassistant/turn_on", entity_id=item  # type:ignore
-                )  # type:ignore
+            # last check until we switch the lights on... really!
+            if not force and any(
+                [await self.read_state(light) == "on" for light in lights]
+            ):
+                self.lg("¯\\_(ツ)_/¯")
+                self.act("already_on")
+                return
+
+            # home assistant scenes switch all lights with a single call
+            if light_setting.startswith("scene.") and not zone:
+                await self.service_call(
+                    "homeassistant/turn_on", entity_id=light_setting  # type:ignore
+                )
                 if self.only_own_events:
-                    self._switched_on_by_automoli.add(item)
+                    self._switched_on_by_automoli.add(light_setting)
+
+            else:
+                calls: list[Coroutine[Any, Any, Any]] = []
+                for entity in lights:
+
+                    if self.manually_controlled(entity):
+                        continue
+
+                    meta = self.entity_meta[entity]
+
+                    if self.active["is_hue_group"] and meta.is_hue_group:
+                        calls.append(
+                            self.service_call(
+                                "hue/hue_activate_scene",
+                                group_name=meta.friendly_name,  # type:ignore
+                                scene_name=light_setting,  # type:ignore
+                            )
+                        )
+                    else:
+                        calls.append(
+                            self.service_call(
+                                "homeassistant/turn_on", entity_id=entity  # type:ignore
+                            )
+                        )
+
+                    if self.only_own_events:
+                        self._switched_on_by_automoli.add(entity)
+
+                await asyncio.gather(*calls)
 
             self.lg(
-                f"{hl(self.room.name.capitalize())} turned {hl('on')} → "
+                f"{hl(where)} turned {hl('on')} → "
                 f"{'hue' if self.active['is_hue_group'] else 'ha'} scene: "
                 f"{hl(light_setting.replace('scene.', ''))}"
-                f" | delay: {hl(natural_time(int(self.active['delay'])))}",
+                f" | delay: {hl(natural_time(self.current_delay()))}",
                 icon=ON_ICON,
             )
 
+            if not zone:
+                self.record_switch("on")
+            self.act(f"on:{light_setting}")
+
         elif isinstance(light_setting, int):
 
-            if light_setting == 0:
+            if light_setting == 0 and zone:
+                await self.zone_off({"zone": zone.name})
+            elif light_setting == 0:
                 await self.lights_off({})
 
             else:
                 # last check until we switch the lights on... really!
                 if not force and any(
-                    [await self.get_state(light) == "on" for light in self.lights]
+                    [await self.read_state(light) == "on" for light in lights]
                 ):
                     self.lg("¯\\_(ツ)_/¯")
+                    self.act("already_on")
                     return
 
-                for entity in self.lights:
+                calls = []
+
+                # pre-staged scene switches all lights with a single call
+                if (scene := self.staged.get(self.stage_name(night))) and (
+                    zone or any(map(self.manually_controlled, self.lights))
+                ):
+                    scene = None
+                if scene:
+                    calls.append(self.service_call("scene/turn_on", entity_id=scene))
+                    if self.only_own_events:
+                        self._switched_on_by_automoli.update(self.lights)
+
+                for entity in [] if scene else lights:
+                    if self.manually_controlled(entity):
+                        continue
                     if entity.startswith("switch."):
-                        await self.call_service(
-                            "homeassistant/turn_on", entity_id=entity  # type:ignore
+                        calls.append(
+                            self.service_call(
+                                "homeassistant/turn_on", entity_id=entity  # type:ignore
+                            )
                         )
                     else:
-                        await self.call_service(
-                            "homeassistant/turn_on",
-                            entity_id=entity,  # type:ignore
-                            brightness_pct=light_setting,  # type:ignore
-                        )
-
-                        self.lg(
-                            f"{hl(self.room.name.capitalize())} turned {hl('on')} → "
-                            f"brightness: {hl(light_setting)}%"
-                            f" | delay: {hl(natural_time(int(self.active['delay'])))}",
-                            icon=ON_ICON,
+                        calls.append(
+                            self.service_call(
+                                "homeassistant/turn_on",
+                                entity_id=entity,  # type:ignore
+                                brightness_pct=light_setting,  # type:ignore
+                            )
                         )
                     if self.only_own_events:
                         self._switched_on_by_automoli.add(entity)
 
+                await asyncio.gather(*calls)
+
+                self.lg(
+                    f"{hl(where)} turned {hl('on')} → "
+                    f"brightness: {hl(light_setting)}%"
+                    f" | delay: {hl(natural_time(self.current_delay()))}",
+                    icon=ON_ICON,
+                )
+
+                if not zone:
+                    self.record_switch("on")
+                self.act(f"on:{light_setting}")
+
         else:
             raise ValueError(
                 f"invalid brightness/scene: {light_setting!s} " f"in {self.room}"
             )
 
+    @journaled
+    @profiled
     async def lights_off(self, _: dict[str, Any]) -> None:
         """Turn off the lights."""
 
@@ -957,57 +4162,68 @@ class AutoMoLi(hass.Hass):  # type: ignore
 
         self.lg(
             f"{stack()[0][3]}: "
-            f"{any([await self.get_state(entity) == 'on' for entity in self.lights]) = }"
+            f"{any([await self.read_state(entity) == 'on' for entity in self.lights]) = }"
             f" | {self.lights = }",
             level=logging.DEBUG,
         )
 
-        # if any([await self.get_state(entity) == "on" for entity in self.lights]):
-        if all([await self.get_state(entity) == "off" for entity in self.lights]):
+        # if any([await self.read_state(entity) == "on" for entity in self.lights]):
+        if all([await self.read_state(entity) == "off" for entity in self.lights]):
             return
 
-        at_least_one_turned_off = False
+        turned_off: set[str] = set()
         for entity in self.lights:
+            if self.manually_controlled(entity):
+                continue
             if self.only_own_events:
                 if entity in self._switched_on_by_automoli:
-                    await self.call_service(
-                        "homeassistant/turn_off", entity_id=entity  # type:ignore
-                    )  # type:ignore
                     self._switched_on_by_automoli.remove(entity)
-                    at_least_one_turned_off = True
+                    turned_off.add(entity)
             else:
-                await self.call_service(
+                turned_off.add(entity)
+
+        await asyncio.gather(
+            *[
+                self.service_call(
                     "homeassistant/turn_off", entity_id=entity  # type:ignore
-                )  # type:ignore
-                at_least_one_turned_off = True
-        if at_least_one_turned_off:
-            self.run_in_thread(self.turned_off, thread=self.notify_thread)
+                )
+                for entity in turned_off
+            ]
+        )
+
+        if turned_off:
+            self.record_switch("off", turned_off)
+            self.act("off")
+            self.turned_off()
 
         # experimental | reset for xiaomi "super motion" sensors | idea from @wernerhp
         # app: https://github.com/wernerhp/appdaemon_aqara_motion_sensors
         # mod:
         # https://community.smartthings.com/t/making-xiaomi-motion-sensor-a-super-motion-sensor/139806
         for sensor in self.sensors[EntityType.MOTION.idx]:
+            # appdaemon 4.0.x drops the attributes not passed to set_state
+            state = await self.read_state(sensor, attribute="all")
+            attributes = state.get("attributes") if state else None
             await self.set_state(
                 sensor,
                 state="off",
-                attributes=(await self.get_state(sensor, attribute="all")).get(
-                    "attributes", {}
-                ),
+                attributes=attributes.copy() if attributes else {},
             )
 
-    async def turned_off(self, _: dict[str, Any] | None = None) -> None:
-        # cancel scheduled callbacks
-        await self.clear_handles()
+    def turned_off(self) -> None:
+        """persist the switched off room & notify, without scheduler round trips"""
 
-        self.lg(
+        self.save_state()
+
+        self.notifications.notify(
+            "turned_off",
             f"no motion in {hl(self.room.name.capitalize())} since "
-            f"{hl(natural_time(int(self.active['delay'])))} → turned {hl('off')}",
+            f"{hl(natural_time(self.current_delay()))} → turned {hl('off')}",
             icon=OFF_ICON,
         )
 
     async def find_sensors(
-        self, keyword: str, room_name: str, states: dict[str, dict[str, Any]]
+        self, keyword: str, room_name: str, states: Mapping[str, Mapping[str, Any]]
     ) -> list[str]:
         """Find sensors by looking for a keyword in the friendly_name."""
 
@@ -1069,19 +4285,19 @@ class AutoMoLi(hass.Hass):  # type: ignore
             else:
                 dt_is_hue_group = (
                     isinstance(dt_light_setting, str)
+                    and dt_light_setting != CIRCADIAN
                     and not dt_light_setting.startswith("scene.")
                     and any(
-                        await asyncio.gather(
-                            *[
-                                self.get_state(
-                                    entity_id=entity, attribute="is_hue_group"
-                                )
-                                for entity in self.lights
-                            ]
-                        )
+                        self.entity_meta[entity].is_hue_group for entity in self.lights
                     )
                 )
 
+            if dt_light_setting == CIRCADIAN and not self.circadian:
+                raise ValueError(
+                    f"daytime '{dt_name}' follows the circadian curves, "
+                    f"but no 'circadian' curves are configured"
+                )
+
             dt_start: time
             try:
                 starttime = daytime.get("starttime")
@@ -1136,12 +4352,16 @@ class AutoMoLi(hass.Hass):  # type: ignore
                 await self.switch_daytime(dict(daytime=daytime, initial=True))
                 self.active_daytime = daytime.get("daytime")
 
+            self.daytime_settings[dt_name] = dt_light_setting
+
             # schedule callbacks for daytime switching
+            # sharded rooms are spread in switch_daytime
+            randomize = 0 if self.shard else RANDOMIZE_SEC
             await self.run_daily(
                 self.switch_daytime,
                 dt_start,
-                random_start=-RANDOMIZE_SEC,
-                random_end=RANDOMIZE_SEC,
+                random_start=-randomize,
+                random_end=randomize,
                 **dict(daytime=daytime),
             )
 
@@ -0,0 +1,153 @@
+"""Local stand-in for Home Assistant's websocket API.
+
+Implements the parts used by AutoMoLi's `HAWebsocket`: authentication, service
+calls answered by id (with per-call delays, so results arrive out of order) and
+`subscribe_entities`. Connections can be dropped to exercise reconnects.
+
+    async with FakeWebsocketServer(token="secret") as server:
+        client = automoli.HAWebsocket(server.url, "secret")
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, Callable
+
+from aiohttp import WSMsgType, web
+
+
+class FakeWebsocketServer:
+    """aiohttp server speaking the websocket protocol of Home Assistant."""
+
+    def __init__(
+        self,
+        token: str = "token",
+        delay: Callable[[dict[str, Any]], float] = lambda message: 0.0,
+    ) -> None:
+        self.token = token
+        self.delay = delay
+        self.states: dict[str, str] = {}
+        self.messages: list[dict[str, Any]] = []
+        self.connections: list[web.WebSocketResponse] = []
+        self.subscriptions: dict[web.WebSocketResponse, dict[int, list[str]]] = {}
+        self.port = 0
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/api/websocket"
+
+    async def __aenter__(self) -> FakeWebsocketServer:
+        app = web.Application()
+        app.router.add_get("/api/websocket", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, *_: Any) -> None:
+        await self.drop()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def drop(self) -> None:
+        """close all client connections"""
+        for ws in list(self.connections):
+            await ws.close()
+
+    async def change(self, entity_id: str, state: str) -> None:
+        """change an entity and send it to the subscribed connections"""
+        self.states[entity_id] = state
+        for ws, subscriptions in list(self.subscriptions.items()):
+            for msg_id, entity_ids in subscriptions.items():
+                if entity_id in entity_ids and not ws.closed:
+                    await ws.send_json(
+                        {
+                            "id": msg_id,
+                            "type": "event",
+                            "event": {"c": {entity_id: {"+": {"s": state}}}},
+                        }
+                    )
+
+    async def handle(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        await ws.send_json({"type": "auth_required", "ha_version": "2024.1.0"})
+        auth = await ws.receive_json()
+        if auth.get("type") != "auth" or auth.get("access_token") != self.token:
+            await ws.send_json({"type": "auth_invalid", "message": "Invalid access"})
+            await ws.close()
+            return ws
+        await ws.send_json({"type": "auth_ok", "ha_version": "2024.1.0"})
+
+        self.connections.append(ws)
+        self.subscriptions[ws] = {}
+        replies: set[asyncio.Task[None]] = set()
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                message = json.loads(msg.data)
+                self.messages.append(message)
+                task = asyncio.ensure_future(self.reply(ws, message))
+                replies.add(task)
+                task.add_done_callback(replies.discard)
+        finally:
+            for task in replies:
+                task.cancel()
+            self.connections.remove(ws)
+            del self.subscriptions[ws]
+
+        return ws
+
+    async def reply(self, ws: web.WebSocketResponse, message: dict[str, Any]) -> None:
+        msg_id = message["id"]
+
+        if message["type"] == "call_service":
+            await asyncio.sleep(self.delay(message))
+            await ws.send_json(
+                {
+                    "id": msg_id,
+                    "type": "result",
+                    "success": True,
+                    "result": {"context": {"id": f"context-{msg_id}"}, "call": message},
+                }
+            )
+
+        elif message["type"] == "subscribe_entities":
+            entity_ids = list(message.get("entity_ids", []))
+            self.subscriptions[ws][msg_id] = entity_ids
+            await ws.send_json(
+                {"id": msg_id, "type": "result", "success": True, "result": None}
+            )
+            await ws.send_json(
+                {
+                    "id": msg_id,
+                    "type": "event",
+                    "event": {
+                        "a": {
+                            entity_id: {"s": self.states.get(entity_id, "unknown")}
+                            for entity_id in entity_ids
+                        }
+                    },
+                }
+            )
+
+        elif message["type"] == "unsubscribe_events":
+            self.subscriptions[ws].pop(message.get("subscription"), None)
+            await ws.send_json(
+                {"id": msg_id, "type": "result", "success": True, "result": None}
+            )
+
+        else:
+            await ws.send_json(
+                {
+                    "id": msg_id,
+                    "type": "result",
+                    "success": False,
+                    "error": {"code": "unknown_command", "message": "Unknown command"},
+                }
+            )
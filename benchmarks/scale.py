@@ -0,0 +1,606 @@
+"""AutoMoLi scale harness.
+
+Generates synthetic rooms, runs AutoMoLi for each of them against a local fake
+AppDaemon and reports startup time, memory per room (tracemalloc), registered
+listeners & scheduler entries and the motion events per second handled before
+the latency degrades.
+
+    python benchmarks/scale.py --rooms 200 --lights 4 --sensors 2 --json scale.json
+
+Results are printed and optionally written as json to compare them across versions.
+With `--shards N` the rooms are sharded over N local processes, coordinated through
+a shared channel directory.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import defaultdict
+from copy import deepcopy
+from datetime import datetime, time, timedelta
+import json
+import logging
+from pathlib import Path
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+import tracemalloc
+import types
+from typing import Any, Callable
+import uuid
+
+APPS_DIR = Path(__file__).resolve().parent.parent / "apps" / "automoli"
+
+SUNRISE = time(6, 30)
+SUNSET = time(19, 30)
+
+
+class FakeAppDaemon:
+    """In-memory states, listeners and scheduler shared by all fake apps."""
+
+    def __init__(self) -> None:
+        self.states: dict[str, dict[str, Any]] = {}
+        self.state_listeners: dict[str, list[tuple[Any, Callable, dict]]] = defaultdict(
+            list
+        )
+        self.event_listeners: dict[str, list[tuple[Any, Callable, dict]]] = defaultdict(
+            list
+        )
+        self.timers: dict[str, tuple[Any, asyncio.TimerHandle | None]] = {}
+        self.service_calls = 0
+        self.latencies: list[float] = []
+        self.tasks: set[asyncio.Future[Any]] = set()
+
+    def add_entity(self, entity_id: str, state: str, **attributes: Any) -> None:
+        self.states[entity_id] = {
+            "entity_id": entity_id,
+            "state": state,
+            "attributes": {"friendly_name": entity_id.split(".", 1)[1], **attributes},
+            "context": {"id": uuid.uuid4().hex},
+        }
+
+    def spawn(self, coroutine: Any, fired: float | None = None) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if fired is not None:
+            task.add_done_callback(
+                lambda _: self.latencies.append(perf_counter() - fired)
+            )
+
+    def change(
+        self,
+        entity_id: str,
+        state: str | None = None,
+        attributes: dict[str, Any] | None = None,
+        measure: bool = False,
+    ) -> None:
+        """update an entity & dispatch the state listeners & state_changed events"""
+
+        old_state = self.states.get(entity_id) or {"state": None, "attributes": {}}
+        new_state = {
+            **old_state,
+            "entity_id": entity_id,
+            "attributes": {**old_state["attributes"], **(attributes or {})},
+            "context": {"id": uuid.uuid4().hex},
+        }
+        if state is not None:
+            new_state["state"] = state
+        self.states[entity_id] = new_state
+
+        fired = perf_counter() if measure else None
+        for _, callback, kwargs in self.state_listeners.get(entity_id, []):
+            if "new" in kwargs and kwargs["new"] != new_state["state"]:
+                continue
+            self.spawn(
+                callback(
+                    entity_id,
+                    "state",
+                    old_state["state"],
+                    new_state["state"],
+                    kwargs,
+                ),
+                fired,
+            )
+        self.fire_event(
+            "state_changed",
+            {"entity_id": entity_id, "old_state": old_state, "new_state": new_state},
+        )
+
+    def fire_event(self, event: str, data: dict[str, Any]) -> None:
+        for _, callback, kwargs in self.event_listeners.get(event, []):
+            if "entity_id" in kwargs and kwargs["entity_id"] != data.get("entity_id"):
+                continue
+            self.spawn(callback(event, data, kwargs))
+
+    def schedule(self, app: Any, delay: float, callback: Callable, kwargs: dict) -> str:
+        handle = uuid.uuid4().hex
+        timer = (
+            asyncio.get_running_loop().call_later(
+                delay, self._fire_timer, handle, callback, kwargs
+            )
+            if delay is not None
+            else None
+        )
+        self.timers[handle] = (app, timer)
+        return handle
+
+    def _fire_timer(self, handle: str, callback: Callable, kwargs: dict) -> None:
+        self.timers.pop(handle, None)
+        self.spawn(callback(kwargs))
+
+
+def sync_decorated(coro_func: Callable) -> Callable:
+    """like appdaemon's sync decorator: calls from the loop return a task"""
+
+    def wrapper(self: Any, *args: Any, **kwargs: Any) -> asyncio.Future[Any]:
+        return asyncio.ensure_future(coro_func(self, *args, **kwargs))
+
+    wrapper.__name__ = coro_func.__name__
+    return wrapper
+
+
+class Hass:
+    """Subset of appdaemon's `hassapi.Hass` used by AutoMoLi."""
+
+    def __init__(
+        self, ad: FakeAppDaemon, name: str, args: dict[str, Any], config_dir: str
+    ):
+        self.fake_ad = ad
+        self.name = name
+        self.args = args
+        self.config_dir = config_dir
+        self.listeners = 0
+        self.log_lines = 0
+
+    def log(self, msg: str, *args: Any, **kwargs: Any) -> None:
+        self.log_lines += 1
+
+    @staticmethod
+    def get_ad_version() -> str:
+        return "4.5.13"
+
+    def get_ad_api(self) -> None:
+        return None
+
+    @sync_decorated
+    async def entity_exists(self, entity_id: str) -> bool:
+        return entity_id in self.fake_ad.states
+
+    @sync_decorated
+    async def get_state(
+        self,
+        entity_id: str | None = None,
+        attribute: str | None = None,
+        default: Any = None,
+        copy: bool = True,
+    ) -> Any:
+        def maybe_copy(data: Any) -> Any:
+            return deepcopy(data) if copy else data
+
+        states = self.fake_ad.states
+        if entity_id is None:
+            return maybe_copy(states)
+        if (state := states.get(entity_id)) is None:
+            return default
+        if attribute is None:
+            return maybe_copy(state["state"])
+        if attribute == "all":
+            return maybe_copy(state)
+        return maybe_copy(state["attributes"].get(attribute, default))
+
+    @sync_decorated
+    async def set_state(self, entity_id: str, **kwargs: Any) -> dict[str, Any]:
+        self.fake_ad.change(entity_id, kwargs.get("state"), kwargs.get("attributes"))
+        return self.fake_ad.states[entity_id]
+
+    @sync_decorated
+    async def call_service(self, service: str, **data: Any) -> dict[str, Any]:
+        self.fake_ad.service_calls += 1
+        entity_ids = data.get("entity_id") or []
+        for entity_id in [entity_ids] if isinstance(entity_ids, str) else entity_ids:
+            if entity_id not in self.fake_ad.states or service.startswith("scene/"):
+                continue
+            if service.endswith("turn_on"):
+                brightness = round(data.get("brightness_pct", 100) * 2.55)
+                self.fake_ad.change(entity_id, "on", {"brightness": brightness})
+            elif service.endswith("turn_off"):
+                self.fake_ad.change(entity_id, "off", {"brightness": None})
+        return {"context": {"id": uuid.uuid4().hex}}
+
+    @sync_decorated
+    async def listen_state(
+        self, callback: Callable, entity_id: str, **kwargs: Any
+    ) -> str:
+        self.listeners += 1
+        self.fake_ad.state_listeners[entity_id].append((self, callback, kwargs))
+        return uuid.uuid4().hex
+
+    @sync_decorated
+    async def listen_event(self, callback: Callable, event: str, **kwargs: Any) -> str:
+        self.listeners += 1
+        self.fake_ad.event_listeners[event].append((self, callback, kwargs))
+        return uuid.uuid4().hex
+
+    @sync_decorated
+    async def register_endpoint(self, callback: Callable, name: str) -> str:
+        return name
+
+    @sync_decorated
+    async def run_in(self, callback: Callable, delay: float, **kwargs: Any) -> str:
+        return self.fake_ad.schedule(self, delay, callback, kwargs)
+
+    @sync_decorated
+    async def run_every(
+        self, callback: Callable, start: Any, interval: float, **kwargs: Any
+    ) -> str:
+        # periodic callbacks are counted, but do not fire during the run
+        return self.fake_ad.schedule(self, None, callback, kwargs)
+
+    @sync_decorated
+    async def run_daily(self, callback: Callable, start: Any, **kwargs: Any) -> str:
+        return self.fake_ad.schedule(self, None, callback, kwargs)
+
+    @sync_decorated
+    async def stop_app(self, app: str) -> None:
+        # only apps stopping themselves: terminated, listeners & timers dropped
+        await self.terminate()  # type: ignore[attr-defined]
+        for listeners in (
+            *self.fake_ad.state_listeners.values(),
+            *self.fake_ad.event_listeners.values(),
+        ):
+            listeners[:] = [
+                listener for listener in listeners if listener[0] is not self
+            ]
+        for handle, (owner, timer) in list(self.fake_ad.timers.items()):
+            if owner is self:
+                del self.fake_ad.timers[handle]
+                if timer:
+                    timer.cancel()
+
+    @sync_decorated
+    async def timer_running(self, handle: str) -> bool:
+        return handle in self.fake_ad.timers
+
+    @sync_decorated
+    async def cancel_timer(self, handle: str, silent: bool = False) -> bool:
+        _, timer = self.fake_ad.timers.pop(handle, (None, None))
+        if timer:
+            timer.cancel()
+        return True
+
+    @sync_decorated
+    async def info_timer(self, handle: str) -> tuple[datetime, float, dict] | None:
+        return None
+
+    @sync_decorated
+    async def get_now(self) -> datetime:
+        return datetime.now().astimezone()
+
+    @sync_decorated
+    async def parse_time(self, time_str: str, name: str | None = None) -> time:
+        if match := re.fullmatch(
+            r"\s*(sunrise|sunset)\s*(?:([+-])\s*(\d+):(\d+)(?::(\d+))?)?\s*", time_str
+        ):
+            base = SUNRISE if match[1] == "sunrise" else SUNSET
+            offset = timedelta(
+                hours=int(match[3] or 0),
+                minutes=int(match[4] or 0),
+                seconds=int(match[5] or 0),
+            )
+            at = datetime.combine(datetime.today(), base)
+            return (at + offset if match[2] != "-" else at - offset).time()
+        return time.fromisoformat(time_str.strip())
+
+    @sync_decorated
+    async def now_is_between(self, start: str, end: str) -> bool:
+        now = datetime.now().time()
+        start_time, end_time = time.fromisoformat(start), time.fromisoformat(end)
+        if start_time <= end_time:
+            return start_time <= now < end_time
+        return now >= start_time or now < end_time
+
+
+def import_automoli() -> types.ModuleType:
+    """import automoli with the fake appdaemon api"""
+    sys.modules["hassapi"] = types.SimpleNamespace(Hass=Hass)  # type: ignore
+    sys.path.insert(0, str(APPS_DIR))
+    import automoli  # pylint: disable=import-outside-toplevel
+
+    return automoli
+
+
+def room_config(
+    idx: int, lights: int, sensors: int, daytimes: int, extra: dict[str, Any]
+) -> dict[str, Any]:
+    step = 24 * 60 // daytimes
+    return {
+        "room": f"room{idx}",
+        "lights": [f"light.room{idx}_{light}" for light in range(lights)],
+        "motion": [
+            f"binary_sensor.motion_sensor_room{idx}_{sensor}"
+            for sensor in range(sensors)
+        ],
+        "motion_state_on": "on",
+        "motion_state_off": "off",
+        "delay": 300,
+        "daytimes": [
+            {
+                "starttime": f"{step * dt // 60:02d}:{step * dt % 60:02d}",
+                "name": f"daytime{dt}",
+                "light": 100 - dt * 80 // daytimes,
+            }
+            for dt in range(daytimes)
+        ],
+        **json.loads(json.dumps(extra)),
+    }
+
+
+def percentile(values: list[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+async def settle(ad: FakeAppDaemon) -> None:
+    while ad.tasks:
+        await asyncio.gather(*list(ad.tasks), return_exceptions=True)
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    logging.disable(logging.CRITICAL)
+    extra = json.loads(args.config)
+    if args.shard:
+        extra["shard"] = {
+            "name": args.shard,
+            "shards": [f"shard{shard}" for shard in range(args.shards)],
+            "channel": str(args.channel),
+        }
+
+    started = perf_counter()
+    automoli = import_automoli()
+    import_sec = perf_counter() - started
+
+    ad = FakeAppDaemon()
+    configs = [
+        room_config(idx, args.lights, args.sensors, args.daytimes, extra)
+        for idx in range(args.rooms)
+    ]
+    for config in configs:
+        for light in config["lights"]:
+            ad.add_entity(light, "off", supported_color_modes=["brightness"])
+        for sensor in config["motion"]:
+            ad.add_entity(sensor, "off")
+
+    storage = tempfile.mkdtemp(prefix="automoli-scale-")
+    tracemalloc.start()
+
+    apps = []
+    memory: list[int] = []
+    started = perf_counter()
+    for config in configs:
+        before = tracemalloc.get_traced_memory()[0]
+        app = automoli.AutoMoLi(ad, config["room"], config, storage)
+        await app.initialize()
+        await settle(ad)
+        memory.append(tracemalloc.get_traced_memory()[0] - before)
+        apps.append(app)
+    startup_sec = perf_counter() - started
+
+    total_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # rooms run by this process, all of them without sharding
+    owned = [app for app in apps if app.room_name in automoli.ROOMS]
+    memory = [size for app, size in zip(apps, memory) if app in owned]
+    # time until the rooms of all shards are seen through the channel
+    channel_rooms, channel_sec = None, None
+    if owned and (channel := owned[0].shard):
+        await channel.state_file.flush()
+        started = perf_counter()
+        while (channel_rooms := len(await channel.view(max_age=0))) < args.rooms:
+            if perf_counter() - started > 60:
+                break
+            await asyncio.sleep(0.1)
+        channel_sec = round(perf_counter() - started, 3)
+
+    # motion events at increasing rates until the latency degrades
+    sensors = [sensor for app in owned for sensor in app.sensors["motion"]]
+    rates: list[dict[str, Any]] = []
+    baseline_p95: float | None = None
+    sustained = 0
+    loop = asyncio.get_running_loop()
+
+    for rate in args.rates:
+        ad.latencies.clear()
+        calls_before = ad.service_calls
+        events = max(1, int(rate * args.duration))
+        begin = loop.time()
+        for event in range(events):
+            if (wait := begin + event / rate - loop.time()) > 0:
+                await asyncio.sleep(wait)
+            sensor = sensors[event % len(sensors)]
+            new = "off" if ad.states[sensor]["state"] == "on" else "on"
+            ad.change(sensor, new, measure=True)
+        await settle(ad)
+        elapsed = loop.time() - begin
+
+        p95 = percentile(ad.latencies, 0.95) * 1000
+        baseline_p95 = baseline_p95 if baseline_p95 is not None else max(p95, 1.0)
+        result = {
+            "rate": rate,
+            "achieved": round(events / elapsed, 1),
+            "p50_ms": round(percentile(ad.latencies, 0.5) * 1000, 3),
+            "p95_ms": round(p95, 3),
+            "service_calls": ad.service_calls - calls_before,
+        }
+        rates.append(result)
+        print(
+            f"  {rate:>7}/s → {result['achieved']:>8}/s achieved | "
+            f"p50 {result['p50_ms']:>8} ms | p95 {result['p95_ms']:>8} ms"
+        )
+
+        if result["achieved"] < rate * 0.9 or p95 > baseline_p95 * args.degrade_factor:
+            break
+        sustained = rate
+
+    # motion-to-command latency of switching on a dark room, from the journals
+    for app in owned:
+        for entity in [*app.lights, *app.sensors["motion"]]:
+            ad.change(entity, "off")
+    await settle(ad)
+    for app in owned:
+        app.latency.clear()
+        ad.change(min(app.sensors["motion"]), "on")
+        await settle(ad)
+    switch_on = [latency for app in owned for latency in app.latency]
+
+    for app in apps:
+        await app.terminate()
+
+    return {
+        "version": automoli.__version__,
+        "python": platform.python_version(),
+        "shard": args.shard,
+        "rooms": len(owned),
+        "channel_rooms": channel_rooms,
+        "channel_sec": channel_sec,
+        "lights_per_room": args.lights,
+        "sensors_per_room": args.sensors,
+        "daytimes_per_room": args.daytimes,
+        "config": extra,
+        "import_sec": round(import_sec, 4),
+        "startup_sec": round(startup_sec, 4),
+        "startup_ms_per_room": round(startup_sec / max(1, len(owned)) * 1000, 3),
+        "memory_total_kib": round(total_memory / 1024, 1),
+        "memory_peak_kib": round(peak_memory / 1024, 1),
+        "memory_per_room_kib": {
+            "median": round(statistics.median(memory or [0]) / 1024, 1),
+            "max": round(max(memory or [0]) / 1024, 1),
+        },
+        "listeners": sum(app.listeners for app in apps),
+        "scheduler_entries": len(ad.timers),
+        "rates": rates,
+        "sustained_events_per_sec": sustained,
+        "switch_on_ms": {
+            "samples": len(switch_on),
+            "p50": round(percentile(switch_on, 0.5), 3),
+            "p95": round(percentile(switch_on, 0.95), 3),
+        },
+    }
+
+
+def run_shards(args: argparse.Namespace) -> None:
+    """run every shard in its own process, sharing one channel directory"""
+
+    workdir = Path(tempfile.mkdtemp(prefix="automoli-shards-"))
+    print(
+        f"{args.rooms} rooms on {args.shards} shards, {args.lights} lights, "
+        f"{args.sensors} sensors, {args.daytimes} daytimes"
+    )
+
+    processes = [
+        subprocess.Popen(  # nosec
+            [
+                sys.executable,
+                __file__,
+                *sys.argv[1:],
+                "--shard",
+                f"shard{shard}",
+                "--channel",
+                str(workdir / "channel"),
+                "--json",
+                str(workdir / f"shard{shard}.json"),
+            ]
+        )
+        for shard in range(args.shards)
+    ]
+    if any(process.wait() for process in processes):
+        sys.exit("a shard failed")
+
+    shards = [
+        json.loads((workdir / f"shard{shard}.json").read_text(encoding="utf-8"))
+        for shard in range(args.shards)
+    ]
+    results = {
+        "shards": shards,
+        "rooms": sum(shard["rooms"] for shard in shards),
+        "sustained_events_per_sec": sum(
+            shard["sustained_events_per_sec"] for shard in shards
+        ),
+    }
+    print(
+        f"rooms per shard: {[shard['rooms'] for shard in shards]}"
+        f" | all rooms seen via the channel after "
+        f"{[shard['channel_sec'] for shard in shards]} s"
+        f" | sustained: {results['sustained_events_per_sec']} events/s in total"
+    )
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--lights", type=int, default=3, help="lights per room")
+    parser.add_argument("--sensors", type=int, default=2, help="sensors per room")
+    parser.add_argument("--daytimes", type=int, default=4, help="daytimes per room")
+    parser.add_argument(
+        "--config", default="{}", help="additional room configuration as json"
+    )
+    parser.add_argument(
+        "--rates",
+        type=lambda rates: [int(rate) for rate in rates.split(",")],
+        default=[50, 100, 200, 500, 1000, 2000, 5000],
+        help="motion events per second to try, comma separated",
+    )
+    parser.add_argument("--duration", type=float, default=2, help="seconds per rate")
+    parser.add_argument(
+        "--degrade-factor",
+        type=float,
+        default=5,
+        help="p95 latency relative to the first rate considered degraded",
+    )
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument(
+        "--shards", type=int, default=1, help="local processes to shard the rooms"
+    )
+    parser.add_argument("--shard", help=argparse.SUPPRESS)
+    parser.add_argument("--channel", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.shards > 1 and not args.shard:
+        run_shards(args)
+        return
+
+    if not args.shard:
+        print(
+            f"{args.rooms} rooms, {args.lights} lights, {args.sensors} sensors, "
+            f"{args.daytimes} daytimes"
+        )
+    results = asyncio.run(run(args))
+
+    if args.shard:
+        print(f"{args.shard}: {results['rooms']} rooms")
+    print(
+        f"startup: {results['startup_sec']} s ({results['startup_ms_per_room']} ms/room)"
+        f" | memory/room: {results['memory_per_room_kib']['median']} KiB"
+        f" (total {results['memory_total_kib']} KiB)"
+        f" | listeners: {results['listeners']}"
+        f" | scheduler entries: {results['scheduler_entries']}"
+        f" | sustained: {results['sustained_events_per_sec']} events/s"
+        f" | motion-to-command p50/p95: {results['switch_on_ms']['p50']}/"
+        f"{results['switch_on_ms']['p95']} ms"
+    )
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
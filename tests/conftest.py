@@ -0,0 +1,18 @@
+"""AutoMoLi with the fake AppDaemon & Home Assistant of the benchmarks."""
+
+from __future__ import annotations
+
+from pathlib import Path
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import scale  # noqa: E402 pylint: disable=wrong-import-position
+
+
+@pytest.fixture(scope="session")
+def automoli() -> types.ModuleType:
+    return scale.import_automoli()
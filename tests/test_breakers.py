@@ -0,0 +1,54 @@
+"""Circuit breakers of the service calls."""
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import types
+from typing import Any
+
+import pytest
+import scale
+
+
+def test_calls_without_entities_have_a_breaker_per_group(
+    automoli: types.ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    call_service = scale.Hass.call_service
+
+    @scale.sync_decorated
+    async def unreachable_bridge(self: Any, service: str, **data: Any) -> Any:
+        if data.get("group_name") == "Hallway":
+            raise RuntimeError("unavailable")
+        return await call_service(self, service, **data)
+
+    monkeypatch.setattr(scale.Hass, "call_service", unreachable_bridge)
+
+    async def run() -> None:
+        ad = scale.FakeAppDaemon()
+        config = scale.room_config(0, 1, 1, 4, {"service_retries": 0})
+        app = automoli.AutoMoLi(ad, "room0", config, str(tmp_path))
+        await app.initialize()
+        await scale.settle(ad)
+
+        for _ in range(automoli.BREAKER_THRESHOLD):
+            await app.service_call(
+                "hue/hue_activate_scene", group_name="Hallway", scene_name="Day"
+            )
+        result = await app.service_call(
+            "hue/hue_activate_scene", group_name="Kitchen", scene_name="Day"
+        )
+        await asyncio.gather(*list(app._tasks))
+
+        assert result is not automoli.FAILED
+        assert app.breakers["Hallway"].is_open
+        assert not app.breakers["Kitchen"].is_open
+
+        health = ad.states["sensor.automoli_room0_service_health"]
+        assert health["state"] == "degraded"
+        assert health["attributes"]["open_breakers"] == 1
+        assert health["attributes"]["open"] == ["Hallway"]
+
+        await app.terminate()
+
+    asyncio.run(run())
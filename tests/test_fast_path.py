@@ -0,0 +1,87 @@
+"""The low latency path switching lights on from cached state."""
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import types
+from typing import Any
+
+import pytest
+import scale
+
+
+async def room(
+    automoli: types.ModuleType, storage: Path, **extra: Any
+) -> tuple[scale.FakeAppDaemon, Any]:
+    ad = scale.FakeAppDaemon()
+    config = scale.room_config(0, 1, 1, 4, {"low_latency": True, **extra})
+    for light in config["lights"]:
+        ad.add_entity(light, "off", supported_color_modes=["brightness"])
+    for sensor in config["motion"]:
+        ad.add_entity(sensor, "off")
+
+    app = automoli.AutoMoLi(ad, "room0", config, str(storage))
+    await app.initialize()
+    await scale.settle(ad)
+    return ad, app
+
+
+@pytest.mark.parametrize("shadow", [False, True])
+def test_none_results_are_sent_calls(
+    automoli: types.ModuleType,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    shadow: bool,
+) -> None:
+    # appdaemon 4.0.x returns nothing from call_service, shadow calls resolve to None
+    call_service = scale.Hass.call_service
+
+    @scale.sync_decorated
+    async def without_result(self: Any, service: str, **data: Any) -> None:
+        await call_service(self, service, **data)
+
+    monkeypatch.setattr(scale.Hass, "call_service", without_result)
+
+    async def run() -> None:
+        ad, app = await room(automoli, tmp_path, shadow=shadow)
+
+        ad.change("binary_sensor.motion_sensor_room0_0", "on")
+        await scale.settle(ad)
+
+        actions = app.journal[-1]["actions"]
+        assert "fast_on" in actions
+        assert "fast_failed" not in actions
+
+        await app.terminate()
+
+    asyncio.run(run())
+
+
+def test_failed_call_falls_back_to_regular_path(
+    automoli: types.ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    call_service = scale.Hass.call_service
+    failures = [1]
+
+    @scale.sync_decorated
+    async def flaky(self: Any, service: str, **data: Any) -> Any:
+        if failures[0]:
+            failures[0] -= 1
+            raise RuntimeError("transient")
+        return await call_service(self, service, **data)
+
+    monkeypatch.setattr(scale.Hass, "call_service", flaky)
+
+    async def run() -> None:
+        ad, app = await room(automoli, tmp_path, service_retries=0)
+
+        ad.change("binary_sensor.motion_sensor_room0_0", "on")
+        await scale.settle(ad)
+
+        assert "fast_failed" in app.journal[-1]["actions"]
+        assert ad.states["light.room0_0"]["state"] == "on"
+
+        await app.terminate()
+
+    asyncio.run(run())
@@ -0,0 +1,89 @@
+"""Pre-lighting the next room on motion."""
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import types
+from typing import Any
+
+import scale
+
+
+async def rooms(
+    automoli: types.ModuleType, storage: Path, *configs: dict[str, Any]
+) -> tuple[scale.FakeAppDaemon, list[Any]]:
+    ad = scale.FakeAppDaemon()
+    for config in configs:
+        for light in config["lights"]:
+            ad.add_entity(light, "off", supported_color_modes=["brightness"])
+        for sensor in config["motion"]:
+            ad.add_entity(sensor, "off")
+
+    apps = []
+    for idx, config in enumerate(configs):
+        app = automoli.AutoMoLi(ad, f"app{idx}", config, str(storage))
+        await app.initialize()
+        await scale.settle(ad)
+        apps.append(app)
+    return ad, apps
+
+
+async def settle(ad: scale.FakeAppDaemon, apps: list[Any]) -> None:
+    """wait for the dispatched callbacks & the background tasks of the rooms"""
+    while ad.tasks or any(app._tasks for app in apps):
+        await scale.settle(ad)
+        for app in apps:
+            await asyncio.gather(*list(app._tasks), return_exceptions=True)
+
+
+def hallway(idx: int, **extra: Any) -> dict[str, Any]:
+    return scale.room_config(idx, 1, 1, 4, {"prelight": {"rooms": ["room1"]}, **extra})
+
+
+def test_prelit_room_journals_its_own_decision(
+    automoli: types.ModuleType, tmp_path: Path
+) -> None:
+    async def run() -> None:
+        ad, (room0, room1) = await rooms(
+            automoli, tmp_path, hallway(0), scale.room_config(1, 1, 1, 4, {})
+        )
+
+        ad.change("binary_sensor.motion_sensor_room0_0", "on")
+        await settle(ad, [room0, room1])
+
+        assert ad.states["light.room1_0"]["state"] == "on"
+        motion = room0.journal[-1]
+        assert motion["handler"] == "motion_detected"
+        assert not any(action.startswith("prelight") for action in motion["actions"])
+        assert room1.journal[-1]["handler"] == "prelit"
+        assert "prelight:room0" in room1.journal[-1]["actions"]
+
+        for app in (room0, room1):
+            await app.terminate()
+
+    asyncio.run(run())
+
+
+def test_shadow_room_does_not_prelight(
+    automoli: types.ModuleType, tmp_path: Path
+) -> None:
+    async def run() -> None:
+        ad, apps = await rooms(
+            automoli,
+            tmp_path,
+            scale.room_config(1, 1, 1, 4, {}),
+            hallway(0, shadow=True),
+        )
+        calls = ad.service_calls
+
+        ad.change("binary_sensor.motion_sensor_room0_0", "on")
+        await settle(ad, apps)
+
+        assert ad.service_calls == calls
+        assert ad.states["light.room1_0"]["state"] == "off"
+
+        for app in apps:
+            await app.terminate()
+
+    asyncio.run(run())
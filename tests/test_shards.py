@@ -0,0 +1,64 @@
+"""Rooms spread over AppDaemon instances (shards)."""
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import types
+from typing import Any
+
+import pytest
+import scale
+
+
+@pytest.mark.parametrize("names", [("a", "b"), ("b", "a")])
+def test_room_claimed_by_two_shards_runs_on_one(
+    automoli: types.ModuleType,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    names: tuple[str, str],
+) -> None:
+    async def shard(ad: scale.FakeAppDaemon, name: str) -> Any:
+        # separate instances, each with its own channel & rooms
+        monkeypatch.setattr(automoli, "SHARDS", {})
+        monkeypatch.setattr(automoli, "ROOMS", {})
+        # differing shard lists → both consider themselves the owner
+        config = scale.room_config(
+            0,
+            1,
+            1,
+            4,
+            {"shard": {"name": name, "shards": [name], "channel": str(tmp_path)}},
+        )
+        app = automoli.AutoMoLi(ad, f"room0_{name}", config, str(tmp_path))
+        await app.initialize()
+        await scale.settle(ad)
+        if app.shard:
+            await app.shard.state_file.flush()
+        return app
+
+    async def run() -> None:
+        ad = scale.FakeAppDaemon()
+        ad.add_entity("light.room0_0", "off", supported_color_modes=["brightness"])
+        ad.add_entity("binary_sensor.motion_sensor_room0_0", "off")
+
+        winner = automoli.HashRing(names).owner("room0")
+        first = await shard(ad, names[0])
+        second = await shard(ad, names[1])
+        assert first.shard is not None
+        assert (second.shard is not None) == (winner == names[1])
+
+        # the first one leaves the room once it sees the preferred second one
+        await first.check_shard()
+        assert (first.room_name in first.shard.rooms) == (winner == names[0])
+        listening = {
+            app
+            for app, _, _ in ad.state_listeners["binary_sensor.motion_sensor_room0_0"]
+        }
+        assert listening == {first if winner == names[0] else second}
+
+        for app in (first, second):
+            if app.shard and app.room_name in app.shard.rooms:
+                await app.terminate()
+
+    asyncio.run(run())
@@ -0,0 +1,177 @@
+"""Pipelined websocket client against the local Home Assistant stand-in."""
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import random
+import types
+from typing import Any
+
+from fake_websocket import FakeWebsocketServer
+import pytest
+import scale
+
+
+def test_invalid_token_fails_to_connect(automoli: types.ModuleType) -> None:
+    async def run() -> None:
+        async with FakeWebsocketServer(token="secret") as server:
+            client = automoli.HAWebsocket(server.url, "wrong")
+            with pytest.raises(ConnectionError, match="authentication failed"):
+                await client.connect()
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_pipelined_results_are_matched_by_id(automoli: types.ModuleType) -> None:
+    async def run() -> None:
+        # random delays → results arrive in a different order than sent
+        async with FakeWebsocketServer(
+            token="secret", delay=lambda _: random.uniform(0, 0.05)  # nosec
+        ) as server:
+            client = automoli.HAWebsocket(server.url, "secret")
+
+            results = await asyncio.gather(
+                *[
+                    client.call_service(
+                        "light/turn_on", entity_id=f"light.l{i}", brightness_pct=i
+                    )
+                    for i in range(30)
+                ]
+            )
+
+            for i, result in enumerate(results):
+                call = result["result"]["call"]
+                assert call["target"] == {"entity_id": f"light.l{i}"}
+                assert call["service_data"] == {"brightness_pct": i}
+                assert automoli.context_ids(result) == [f"context-{result['id']}"]
+            assert len(server.connections) == 1
+
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_reconnect_renews_subscriptions(
+    automoli: types.ModuleType, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(automoli, "WEBSOCKET_RECONNECT_SEC", 0.05)
+
+    async def run() -> None:
+        async with FakeWebsocketServer(token="secret") as server:
+            server.states["light.a"] = "off"
+            client = automoli.HAWebsocket(server.url, "secret")
+            client.users = 1
+
+            states: dict[str, Any] = {}
+
+            def changed(event: dict[str, Any]) -> None:
+                for entity, state in (event.get("a") or {}).items():
+                    states[entity] = state["s"]
+                for entity, diff in (event.get("c") or {}).items():
+                    states[entity] = diff["+"]["s"]
+
+            await client.subscribe_entities(["light.a"], changed)
+            await asyncio.sleep(0.05)
+            assert states == {"light.a": "off"}
+
+            # calls in flight fail when the connection drops
+            server.delay = lambda _: 1.0
+            pending = asyncio.ensure_future(client.call_service("light/turn_on"))
+            await asyncio.sleep(0.05)
+            await server.drop()
+            with pytest.raises(ConnectionError):
+                await pending
+            server.delay = lambda _: 0.0
+
+            # reconnected & subscribed again, changes arrive on the new connection
+            for _ in range(50):
+                if server.connections and server.subscriptions[server.connections[0]]:
+                    break
+                await asyncio.sleep(0.05)
+            subscribes = [
+                m for m in server.messages if m["type"] == "subscribe_entities"
+            ]
+            assert len(subscribes) == 2
+
+            await server.change("light.a", "on")
+            await asyncio.sleep(0.05)
+            assert states == {"light.a": "on"}
+
+            result = await client.call_service("light/turn_off", entity_id="light.a")
+            assert result["success"] is True
+
+            client.users = 0
+            await client.unsubscribe(changed)
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_missing_token_is_a_config_error(
+    automoli: types.ModuleType, tmp_path: Path
+) -> None:
+    ad = scale.FakeAppDaemon()
+    config = scale.room_config(
+        0, 1, 1, 4, {"websocket": {"url": "ws://127.0.0.1:8123/api/websocket"}}
+    )
+    app = automoli.AutoMoLi(ad, "room0", config, str(tmp_path))
+
+    with pytest.raises(ValueError, match="token"):
+        asyncio.run(app.initialize())
+
+
+def test_unresponsive_websocket_falls_back_to_appdaemon(
+    automoli: types.ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(automoli, "WEBSOCKET_CONNECT_TIMEOUT_SEC", 0.1)
+
+    async def run() -> None:
+        # accepts connections, but never answers the handshake
+        connections: list[asyncio.StreamWriter] = []
+
+        async def accept(_: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            connections.append(writer)
+
+        server = await asyncio.start_server(accept, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        ad = scale.FakeAppDaemon()
+        config = scale.room_config(
+            0,
+            1,
+            1,
+            4,
+            {
+                "low_latency": True,
+                "websocket": {
+                    "url": f"ws://127.0.0.1:{port}/api/websocket",
+                    "token": "secret",
+                },
+            },
+        )
+        for light in config["lights"]:
+            ad.add_entity(light, "off", supported_color_modes=["brightness"])
+        for sensor in config["motion"]:
+            ad.add_entity(sensor, "off")
+
+        app = automoli.AutoMoLi(ad, "room0", config, str(tmp_path))
+        await asyncio.wait_for(app.initialize(), 5)
+        await scale.settle(ad)
+
+        assert app.websocket is None
+        assert not automoli.WEBSOCKETS
+
+        # the cache of the fast path is kept current by appdaemon instead
+        ad.change("light.room0_0", "on")
+        await scale.settle(ad)
+        assert app._cache["light.room0_0"] == "on"
+
+        await app.terminate()
+        for writer in connections:
+            writer.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(run())
@@ -0,0 +1,96 @@
+"""Zones switching light subsets by their own motion sensors."""
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import types
+
+import scale
+
+COUNTER = "light.kitchen_counter"
+CEILING = "light.kitchen_ceiling"
+COUNTER_MOTION = "binary_sensor.motion_kitchen_counter"
+HUMIDITY = "sensor.humidity_kitchen"
+
+
+async def kitchen(
+    automoli: types.ModuleType, storage: Path
+) -> tuple[scale.FakeAppDaemon, object]:
+    ad = scale.FakeAppDaemon()
+    for light in (COUNTER, CEILING):
+        ad.add_entity(light, "off", supported_color_modes=["brightness"])
+    ad.add_entity("binary_sensor.motion_kitchen", "off")
+    ad.add_entity(COUNTER_MOTION, "off")
+    ad.add_entity(HUMIDITY, "50")
+
+    config = {
+        **scale.room_config(0, 0, 0, 4, {}),
+        "room": "kitchen",
+        "lights": [CEILING, COUNTER],
+        "motion": ["binary_sensor.motion_kitchen", COUNTER_MOTION],
+        "zones": {"counter": {"lights": COUNTER, "motion": COUNTER_MOTION}},
+        "humidity": HUMIDITY,
+        "humidity_threshold": 60,
+    }
+    app = automoli.AutoMoLi(ad, "kitchen", config, str(storage))
+    await app.initialize()
+    await scale.settle(ad)
+    return ad, app
+
+
+def test_zone_motion_switches_only_zone_lights(
+    automoli: types.ModuleType, tmp_path: Path
+) -> None:
+    async def run() -> None:
+        ad, app = await kitchen(automoli, tmp_path)
+
+        ad.change(COUNTER_MOTION, "on")
+        await scale.settle(ad)
+
+        assert ad.states[COUNTER]["state"] == "on"
+        assert ad.states[CEILING]["state"] == "off"
+
+        # the zone timer starts once the zone's motion clears
+        ad.change(COUNTER_MOTION, "off")
+        await scale.settle(ad)
+
+        assert app.zones["counter"].handle is not None
+
+        await app.terminate()
+
+    asyncio.run(run())
+
+
+def test_blocked_zone_stays_on_with_its_timer_rearmed(
+    automoli: types.ModuleType, tmp_path: Path
+) -> None:
+    async def run() -> None:
+        ad, app = await kitchen(automoli, tmp_path)
+        zone = app.zones["counter"]
+
+        ad.change(COUNTER_MOTION, "on")
+        await scale.settle(ad)
+        ad.change(COUNTER_MOTION, "off")
+        ad.change(HUMIDITY, "70")
+        await scale.settle(ad)
+
+        # the zone timer fires while humidity blocks
+        await app.zone_off({"zone": "counter"})
+        await scale.settle(ad)
+
+        assert ad.states[COUNTER]["state"] == "on"
+        assert zone.handle is not None
+        assert await app.timer_running(zone.handle)
+
+        # the re-armed timer switches the zone off once unblocked
+        ad.change(HUMIDITY, "50")
+        await app.zone_off({"zone": "counter"})
+        await scale.settle(ad)
+
+        assert ad.states[COUNTER]["state"] == "off"
+        assert zone.handle is None
+
+        await app.terminate()
+
+    asyncio.run(run())